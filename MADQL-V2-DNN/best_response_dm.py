@@ -0,0 +1,62 @@
+import logging
+import time
+
+from config import *
+from utils import Algorithm, index2Action
+
+
+class BestResponse:
+    """
+    Network-wide iterated best response, links take turns to pick the action maximizing system capacity
+    given actions of the others, until no action changes in a round
+    """
+
+    def __init__(self, maxRound=BEST_RESPONSE_MAX_ROUND):
+        self.logger = logging.getLogger()
+        self.algorithm = Algorithm.BEST_RESPONSE
+        self.maxRound = maxRound
+        self.timeSlot = 0
+        self.accumulateTime = 0.
+        self.accumulateRound = 0
+        self.elapsedTime = []                                    # search time of every time slot
+
+    def printInformation(self):
+        if self.timeSlot % PRINT_SLOT == 0:
+            self.logger.info(f'best response time slot = {self.timeSlot}, average search time = '
+                             f'{self.accumulateTime / PRINT_SLOT} s, average round = '
+                             f'{self.accumulateRound / PRINT_SLOT}')
+            self.accumulateTime = 0.
+            self.accumulateRound = 0
+
+    def getElapsedTime(self):
+        return self.elapsedTime
+
+    def takeAction(self, env):
+        startTime = time.time()
+        # start from max power and the best beamformer of direct channel
+        linkIndex = np.arange(env.linkNumber)
+        beamformer = np.argmax(env.getProjection()[linkIndex, linkIndex, :], axis=1)
+        accumulator = env.buildInterferenceAccumulator([[0, int(b)] for b in beamformer])
+        # iterate
+        roundNumber = 0
+        changed = True
+        while changed and roundNumber < self.maxRound:
+            changed = False
+            for index in range(env.linkNumber):
+                systemCapacity = np.sum(accumulator.calLinkActionCapacity(index), axis=1)
+                currentIndex = accumulator.actions[index, 0] * CODEBOOK_SIZE + accumulator.actions[index, 1]
+                bestIndex = int(np.argmax(systemCapacity))
+                if systemCapacity[bestIndex] > systemCapacity[currentIndex]:
+                    accumulator.setAction(index, index2Action(bestIndex))
+                    changed = True
+            roundNumber += 1
+        actions = accumulator.getActions()
+        elapsedTime = time.time() - startTime
+        self.logger.debug(f"Best response actions: {actions}, round: {roundNumber}, search time: {elapsedTime} s")
+        # record
+        self.elapsedTime.append(elapsedTime)
+        self.accumulateTime += elapsedTime
+        self.accumulateRound += roundNumber
+        self.timeSlot += 1
+        self.printInformation()
+        return actions
@@ -1,7 +1,9 @@
 import logging
 import random
+import time
+from multiprocessing import Pool, shared_memory
 
-from utils import Algorithm, calCapacity, calLocalCapacity
+from utils import Algorithm, calCapacity, calLocalCapacity, getLinkIndexByCUIndex, index2Action, dBm2num
 from config import *
 
 
@@ -63,17 +65,234 @@ def powerBeamCellES(env, CUIndex):
     return actions
 
 
+def calLocalActionTerms(directProjection, localGain):
+    """
+    Signal, noise and interference terms of every action of the 3 links in a CU
+    Args:
+        directProjection: ||H_ii * f||, shape: [3, CODEBOOK_SIZE]
+        localGain: interference gain among the 3 links, shape: [3, 3, CODEBOOK_SIZE, CODEBOOK_SIZE]
+    Returns:
+        signal power, shape: [3, OUTPUT_LAYER]
+        noise power, shape: [3, OUTPUT_LAYER]
+        interference power from link m to link l, shape: [3, 3, OUTPUT_LAYER, OUTPUT_LAYER]
+        action index is power index * CODEBOOK_SIZE + beamformer index (same as index2Action)
+    """
+    power = np.repeat(dBm2num(np.asarray(POWER_LIST, dtype=FLOAT_DTYPE)), CODEBOOK_SIZE)
+    beamformer = np.tile(np.arange(CODEBOOK_SIZE), POWER_LEVEL)
+    projection = directProjection[:, beamformer]
+    signalPower = power * np.power(projection, 4)
+    noisePower = dBm2num(NOISE_POWER) * np.power(projection, 2)
+    interferencePower = localGain[:, :, beamformer[:, None], beamformer] * power
+    return signalPower, noisePower, interferencePower
+
+
+def calLocalCapacityGrid(directProjection, localGain):
+    """
+    Sum capacity of a CU for every joint action
+    Returns:
+        sum capacity, shape: [OUTPUT_LAYER, OUTPUT_LAYER, OUTPUT_LAYER], indexed by action index of the 3 links
+    """
+    S, N, I = calLocalActionTerms(directProjection, localGain)
+    capacity = np.log2(1 + S[0][:, None, None] / (N[0][:, None, None] + I[0, 1][:, :, None] + I[0, 2][:, None, :]))
+    capacity = capacity + np.log2(1 + S[1][None, :, None] / (N[1][None, :, None] + I[1, 0].T[:, :, None]
+                                                             + I[1, 2][None, :, :]))
+    capacity = capacity + np.log2(1 + S[2][None, None, :] / (N[2][None, None, :] + I[2, 0].T[:, None, :]
+                                                             + I[2, 1].T[None, :, :]))
+    return capacity
+
+
+def branchBoundLocal(directProjection, localGain):
+    """
+    Exact maximum of CU sum capacity by branch and bound over link 0 -> link 1 -> link 2
+    upper bound of a branch: interference from links not assigned yet is replaced by its minimum over their actions,
+    a coordinate ascent solution gives the initial lower bound, surviving a1 of an a0 are evaluated in one block,
+    every bound costs a block of link 2 terms as large as a leaf block, so it is only worthwhile for larger grids
+    than the default power and beamformer sets (slower than calLocalCapacityGrid there)
+    Returns:
+        action index of the 3 links, same optimum (and tie break) as calLocalCapacityGrid argmax
+        number of evaluated joint actions and bound entries
+    """
+    S, N, I = calLocalActionTerms(directProjection, localGain)
+    minI = np.min(I, axis=3)                                    # minI[l, m, a_l] = min of I[l, m, a_l, :]
+    evaluations = 0
+
+    def leafCapacity(a0, a1):
+        """sum capacity of (a0, every a1 in a1, every action of link 2), same operation order as calLocalCapacityGrid"""
+        capacity = np.log2(1 + S[0, a0] / (N[0, a0] + I[0, 1, a0, a1][:, None] + I[0, 2, a0, :]))
+        capacity = capacity + np.log2(1 + S[1, a1][:, None] / (N[1, a1][:, None] + I[1, 0, a1, a0][:, None]
+                                                               + I[1, 2][a1, :]))
+        return capacity + np.log2(1 + S[2] / (N[2] + I[2, 0, :, a0] + I[2, 1][:, a1].T))
+
+    # lower bound: coordinate ascent from the zero-interference best actions
+    actionIndexes = np.argmax(np.log2(1 + S / N), axis=1)
+    for _ in range(2):
+        for link in range(3):
+            others = [other for other in range(3) if other != link]
+            capacity = np.log2(1 + S[link] / (N[link] + I[link, others[0], :, actionIndexes[others[0]]]
+                                              + I[link, others[1], :, actionIndexes[others[1]]]))
+            for other in others:
+                third = 3 - link - other
+                capacity = capacity + np.log2(1 + S[other, actionIndexes[other]]
+                                              / (N[other, actionIndexes[other]]
+                                                 + I[other, link, actionIndexes[other], :]
+                                                 + I[other, third, actionIndexes[other], actionIndexes[third]]))
+            evaluations += len(capacity)
+            actionIndexes[link] = np.argmax(capacity)
+    bestCapacity = np.max(leafCapacity(actionIndexes[0], actionIndexes[1:2])) * (1 - 1e-9)
+    bestIndex = None
+    evaluations += S.shape[1]
+
+    # level 0 bound of every a0: link 0 sees minimum interference, link 1/2 see a0 and minimum of the other
+    bound2 = np.max(np.log2(1 + S[2][:, None] / (N[2][:, None] + I[2, 0] + minI[2, 1][:, None])), axis=0)
+    bound0 = np.log2(1 + S[0] / (N[0] + minI[0, 1] + minI[0, 2])) \
+        + np.max(np.log2(1 + S[1][:, None] / (N[1][:, None] + I[1, 0] + minI[1, 2][:, None])), axis=0) \
+        + bound2
+    evaluations += 2 * bound2.size ** 2 + bound2.size
+    for a0 in np.argsort(-bound0, kind="stable"):
+        if bound0[a0] < bestCapacity:
+            break
+        # level 1 bound of every a1 under a0, link 2 sees both a0 and a1
+        bound1 = np.log2(1 + S[0, a0] / (N[0, a0] + I[0, 1, a0, :] + minI[0, 2, a0])) \
+            + np.log2(1 + S[1] / (N[1] + I[1, 0, :, a0] + minI[1, 2])) \
+            + np.max(np.log2(1 + S[2][:, None] / (N[2][:, None] + I[2, 0, :, a0][:, None] + I[2, 1])), axis=0)
+        evaluations += bound1.size ** 2 + 2 * bound1.size
+        # leaves: every a1 whose bound reaches the best found, with all actions of link 2
+        a1 = np.flatnonzero(bound1 >= bestCapacity)
+        if len(a1) == 0:
+            continue
+        capacity = leafCapacity(a0, a1)
+        evaluations += capacity.size
+        row, a2 = np.unravel_index(np.argmax(capacity), capacity.shape)
+        index = (int(a0), int(a1[row]), int(a2))
+        if capacity[row, a2] > bestCapacity or (capacity[row, a2] == bestCapacity
+                                                and (bestIndex is None or index < bestIndex)):
+            bestCapacity = capacity[row, a2]
+            bestIndex = index
+    return bestIndex, evaluations
+
+
+def searchCUGrid(projection, interferenceGain, CUIndex, branchBound=False):
+    """
+    search CU on projection and interference gain tensors of whole network
+    Returns:
+        actions of the 3 links
+        number of evaluated joint actions
+    """
+    indexes = getLinkIndexByCUIndex(CUIndex)
+    directProjection = projection[indexes, indexes, :]
+    localGain = interferenceGain[np.ix_(indexes, indexes)]
+    if branchBound:
+        actionIndexes, evaluations = branchBoundLocal(directProjection, localGain)
+    else:
+        capacity = calLocalCapacityGrid(directProjection, localGain)
+        actionIndexes = np.unravel_index(np.argmax(capacity), capacity.shape)
+        evaluations = capacity.size
+    return [index2Action(int(actionIndex)) for actionIndex in actionIndexes], evaluations
+
+
+def powerBeamCellESGrid(env, CUIndex):
+    """same result as powerBeamCellES, score all power and beamformer combinations of CU at once"""
+    return searchCUGrid(env.getProjection(), env.getInterferenceGain(), CUIndex)[0]
+
+
+def powerBeamCellESBranchBound(env, CUIndex):
+    """same result as powerBeamCellES, skip branches whose capacity upper bound is below the best found"""
+    return searchCUGrid(env.getProjection(), env.getInterferenceGain(), CUIndex, branchBound=True)[0]
+
+
+"""worker process of CellES, read-only views of channel arrays in shared memory"""
+workerSharedMemory = {}
+workerArrays = {}
+
+
+def _initWorker_(arraySpecs):
+    for key, (name, shape, dtype) in arraySpecs.items():
+        workerSharedMemory[key] = shared_memory.SharedMemory(name=name)
+        array = np.ndarray(shape, dtype=dtype, buffer=workerSharedMemory[key].buf)
+        array.flags.writeable = False
+        workerArrays[key] = array
+
+
+def _searchCU_(CUIndex, branchBound):
+    return searchCUGrid(workerArrays["projection"], workerArrays["interferenceGain"], CUIndex, branchBound)
+
+
 class CellES:
-    """Only Can be Used When CELL_NUMBER = 1"""
+    """Local ES of every CU, independent CUs are searched in a process pool when processNumber > 1"""
 
-    def __init__(self):
+    def __init__(self, processNumber=CELL_ES_PROCESS_NUMBER, branchBound=CELL_ES_BRANCH_BOUND):
         self.logger = logging.getLogger()
         self.algorithm = Algorithm.CELL_ES
+        self.processNumber = processNumber
+        self.branchBound = branchBound
+        self.pool = None
+        self.sharedMemory = {}
+        self.sharedArrays = {}
+        self.timeSlot = 0
+        self.accumulateTime = 0.
+        self.accumulateEvaluations = 0
+        self.elapsedTime = []                                    # search time of every time slot
+
+    def printInformation(self):
+        if self.timeSlot % PRINT_SLOT == 0:
+            self.logger.info(f'ES time slot = {self.timeSlot}, average search time = '
+                             f'{self.accumulateTime / PRINT_SLOT} s, average evaluations = '
+                             f'{self.accumulateEvaluations / PRINT_SLOT}')
+            self.accumulateTime = 0.
+            self.accumulateEvaluations = 0
+
+    def getElapsedTime(self):
+        return self.elapsedTime
+
+    def _startPool_(self, arrays):
+        """allocate shared memory for channel arrays and start worker processes"""
+        arraySpecs = {}
+        for key, array in arrays.items():
+            self.sharedMemory[key] = shared_memory.SharedMemory(create=True, size=array.nbytes)
+            self.sharedArrays[key] = np.ndarray(array.shape, dtype=array.dtype, buffer=self.sharedMemory[key].buf)
+            arraySpecs[key] = (self.sharedMemory[key].name, array.shape, array.dtype)
+        self.pool = Pool(self.processNumber, initializer=_initWorker_, initargs=(arraySpecs,))
+        self.logger.info(f"--------------------Start {self.processNumber} ES Processes-----------------------")
+
+    def close(self):
+        """stop worker processes and release shared memory"""
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+        for sharedMemory in self.sharedMemory.values():
+            sharedMemory.close()
+            sharedMemory.unlink()
+        self.sharedMemory = {}
+        self.sharedArrays = {}
+
+    def searchParallel(self, env, CUNumber):
+        arrays = {"projection": env.getProjection(), "interferenceGain": env.getInterferenceGain()}
+        if self.pool is not None and any(self.sharedArrays[key].shape != array.shape
+                                         or self.sharedArrays[key].dtype != array.dtype
+                                         for key, array in arrays.items()):
+            self.close()
+        if self.pool is None:
+            self._startPool_(arrays)
+        for key, array in arrays.items():
+            np.copyto(self.sharedArrays[key], array)
+        return self.pool.starmap(_searchCU_, [(CUIndex, self.branchBound) for CUIndex in range(CUNumber)])
 
     def takeAction(self, env):
-        actions = []
-        for CUIndex in range(CELL_NUMBER):
-            CUActions = powerBeamCellES(env, CUIndex)
-            actions.extend(CUActions)
-        self.logger.info(f"Local ES actions: {actions}")
+        startTime = time.time()
+        CUNumber = env.linkNumber // 3
+        if self.processNumber > 1 and CUNumber > 1:
+            results = self.searchParallel(env, CUNumber)
+        else:
+            results = [searchCUGrid(env.getProjection(), env.getInterferenceGain(), CUIndex, self.branchBound)
+                       for CUIndex in range(CUNumber)]
+        actions = [action for CUActions, _ in results for action in CUActions]
+        self.accumulateEvaluations += sum(evaluations for _, evaluations in results)
+        elapsedTime = time.time() - startTime
+        self.logger.debug(f"Local ES actions: {actions}, search time: {elapsedTime} s")
+        # record
+        self.elapsedTime.append(elapsedTime)
+        self.accumulateTime += elapsedTime
+        self.timeSlot += 1
+        self.printInformation()
         return actions
@@ -48,6 +48,86 @@ def calDistance(sectorPosition, uePosition):
     return np.sqrt(dis)
 
 
+def calPathLossBatch(distance, isShadowing=True):
+    """same as path loss of Channel for an array of distance"""
+    if isShadowing:
+        shadowing = dB2num(SHADOWING_SIGMA * np.random.rand(*np.shape(distance)))
+        return (1 / np.sqrt(np.power(distance, ALPHA) + shadowing)).astype(FLOAT_DTYPE)
+    else:
+        return (1 / np.sqrt(np.power(distance, ALPHA))).astype(FLOAT_DTYPE)
+
+
+def generatePathGeometry(shape):
+    """
+    Draw AoA/AoD steering vectors of every path
+    Args:
+        shape: shape of channel batch
+    Returns:
+        AoA, shape + [UT_ANTENNA, PATH_NUMBER]
+        AoD, shape + [PATH_NUMBER, BS_ANTENNA]
+    """
+    thetaSend = (np.random.rand(*shape, PATH_NUMBER, 1) * 2 * np.pi).astype(FLOAT_DTYPE)
+    thetaReceive = (np.random.rand(*shape, 1, PATH_NUMBER) * 2 * np.pi).astype(FLOAT_DTYPE)
+    AoD = np.exp(-np.pi * np.sin(thetaSend) * 1j * np.arange(BS_ANTENNA, dtype=FLOAT_DTYPE))
+    AoA = np.exp(-np.pi * np.sin(thetaReceive) * 1j * np.arange(UT_ANTENNA, dtype=FLOAT_DTYPE).reshape(-1, 1))
+    return AoA, AoD
+
+
+def generatePathGain(shape, ricianFactor=dB2num(RICIAN_FACTOR)):
+    """
+    Draw complex gain of every path, path 0 is LoS
+    Args:
+        shape: shape of channel batch
+        ricianFactor: K_R, linear scale
+    Returns:
+        path gain, shape + [PATH_NUMBER]
+    """
+    pathGain = np.zeros(shape=[*shape, PATH_NUMBER], dtype=COMPLEX_DTYPE)
+    pathGain[..., 0] = np.sqrt(ricianFactor / (1 + ricianFactor))
+    hTheta = (np.random.rand(*shape, PATH_NUMBER - 1) * 2 * np.pi).astype(FLOAT_DTYPE)
+    pathGain[..., 1:] = np.exp(1j * hTheta) * np.sqrt(1 / ((1 + ricianFactor) * (PATH_NUMBER - 1)))
+    return pathGain
+
+
+def evolvePathGain(pathGain, ricianFactor=dB2num(RICIAN_FACTOR), correlation=rho):
+    """
+    First-order Gauss-Markov (AR(1)) evolution of path gain, LoS path is kept
+    Args:
+        pathGain: path gain of last time slot, shape + [PATH_NUMBER]
+        ricianFactor: K_R, linear scale
+        correlation: correlation coefficient between two adjacent time slots
+    Returns:
+        path gain of current time slot
+    """
+    shape = pathGain[..., 1:].shape
+    innovation = (np.random.randn(*shape) + 1j * np.random.randn(*shape)) / np.sqrt(2)
+    innovation = (innovation * np.sqrt(1 / ((1 + ricianFactor) * (PATH_NUMBER - 1)))).astype(pathGain.dtype)
+    pathGain = pathGain.copy()
+    pathGain[..., 1:] = correlation * pathGain[..., 1:] + (1 - correlation ** 2) ** 0.5 * innovation
+    return pathGain
+
+
+def composeCSI(AoA, pathGain, AoD, pathLoss):
+    """sum of h * AoA * AoD^T over paths, scaled by path loss"""
+    csi = np.matmul(AoA * np.expand_dims(pathGain, -2), AoD)
+    return csi * np.expand_dims(pathLoss, (-1, -2))
+
+
+def generateCSIBatch(pathLoss, ricianFactor=dB2num(RICIAN_FACTOR)):
+    """
+    Calculate small-scale fading of a batch of channels at once
+    Args:
+        pathLoss: path loss of every channel, any shape
+        ricianFactor: K_R, linear scale
+    Returns:
+        CSI, shape of pathLoss + [UT_ANTENNA, BS_ANTENNA]
+    """
+    shape = np.shape(pathLoss)
+    AoA, AoD = generatePathGeometry(shape)
+    pathGain = generatePathGain(shape, ricianFactor)
+    return composeCSI(AoA, pathGain, AoD, pathLoss)
+
+
 class Channel:
     def __init__(self, sectorPosition, uePosition, ricianFactor=RICIAN_FACTOR, isShadowing=True):
         self.distance = calDistance(sectorPosition, uePosition)
@@ -62,36 +142,13 @@ class Channel:
         else:
             return 1 / np.sqrt(self.distance ** ALPHA)
 
-    def _calAoAAoD_(self):
-        AoD = np.zeros(shape=[BS_ANTENNA, 1], dtype=complex)
-        AoA = np.zeros(shape=[UT_ANTENNA, 1], dtype=complex)
-        thetaSend = np.random.rand() * 2 * np.pi
-        thetaReceive = np.random.rand() * 2 * np.pi
-        for n in range(BS_ANTENNA):
-            AoD[n][0] = np.exp(-np.pi * np.sin(thetaSend) * 1j * n)
-        for m in range(UT_ANTENNA):
-            AoA[m][0] = np.exp(-np.pi * np.sin(thetaReceive) * 1j * m)
-        return AoA, AoD
-
     def _calCSI_(self):
         """
         Calculate small-scale fading
         Returns:
             single time slot small-scale fading
         """
-        csi = np.zeros(shape=[UT_ANTENNA, BS_ANTENNA], dtype=complex)
-        for path in range(PATH_NUMBER):
-            AoA, AoD = self._calAoAAoD_()
-            # h
-            if path == 0:
-                h = np.sqrt(self.ricianFactor / (1 + self.ricianFactor))    # LoS
-            else:
-                hTheta = np.random.rand() * 2 * np.pi
-                h = np.cos(hTheta) + 1j * np.sin(hTheta)
-                h = h * np.sqrt(1 / ((1 + self.ricianFactor) * (PATH_NUMBER - 1)))
-            csi += h * np.matmul(AoA, np.transpose(AoD))
-        csi = csi * self.pathLoss
-        return csi
+        return generateCSIBatch(self.pathLoss, self.ricianFactor)
 
     def update(self):
         self.CSI = self._calCSI_()
@@ -106,6 +163,20 @@ class Channel:
         return self.pathLoss
 
 
+class ChannelView:
+    """Read-only Channel interface on top of the channel store of Environment"""
+
+    def __init__(self, CSI, pathLoss):
+        self.CSI = CSI
+        self.pathLoss = pathLoss
+
+    def getCSI(self):
+        return self.CSI
+
+    def getPathLoss(self):
+        return self.pathLoss
+
+
 if __name__ == "__main__":
     EXECUTION_MODE = "PRINT_SINGLE_CHANNEL_CSI"
     if EXECUTION_MODE == "PRINT_SINGLE_CHANNEL_CSI":
@@ -51,6 +51,11 @@ def calOutputLayer(powerLevel, codebookSize):
     return powerLevel * codebookSize
 
 
+# numerical precision, from channel generation to DQN input
+SINGLE_PRECISION = False            # complex64/float32, else complex128/float64
+COMPLEX_DTYPE = np.complex64 if SINGLE_PRECISION else np.complex128
+FLOAT_DTYPE = np.float32 if SINGLE_PRECISION else np.float64
+
 BS_ANTENNA = 16
 UT_ANTENNA = 4
 BS_HEIGHT = 10.
@@ -64,6 +69,7 @@ POWER_LIST = generatePowerList(MAX_POWER, POWER_LEVEL)
 # beamformer vector list
 CODEBOOK_SIZE = 8
 BEAMFORMER_LIST = generateBeamformerList(UT_ANTENNA)
+BEAMFORMER_MATRIX = np.concatenate(BEAMFORMER_LIST, axis=1).astype(COMPLEX_DTYPE)   # BS_ANTENNA * CODEBOOK_SIZE
 
 # wireless channel
 ALPHA = 3                           # path loss exponent
@@ -75,19 +81,39 @@ PATH_NUMBER = 6                     # LOS path number
 RICIAN_FACTOR = 10                  # K_R
 # Markov channel change
 rho = 0.6425                        # Markov Channel Change
+MARKOV_CHANNEL = False              # keep path geometry and evolve path gain with rho, else i.i.d. every slot
 
 # cellular network
 CELL_SIZE = 30.                     # m
-CELL_NUMBER = 7
+CELL_RING = 1                       # rings of cells around the center cell
+CELL_NUMBER = 1 + 3 * CELL_RING * (CELL_RING + 1)
 R_MIN = 5.
 R_MAX = 20.
+UE_MOBILITY = "NONE"                # NONE, CONSTANT_VELOCITY or RANDOM_WAYPOINT
+UE_SPEED = 1.                       # m per time slot
+UE_PAUSE_SLOT = 10                  # time slots a UE stays at a waypoint
+SPARSE_ENVIRONMENT = False          # keep only channels of interference neighborhoods, for large networks
+INTERFERENCE_RADIUS = 100.          # m, sectors within the radius of a UE are its interferers in sparse mode
+
+# cell ES
+CELL_ES_PROCESS_NUMBER = 1          # CUs are searched in a process pool when > 1
+CELL_ES_BRANCH_BOUND = False        # branch and bound instead of full power x beam grid
+
+# best response
+BEST_RESPONSE_MAX_ROUND = 20        # rounds over all links before giving up on convergence
 
 # memory pool
 MP_MAX_SIZE = 2048
 BATCH_SIZE = 256
+PRIORITIZED_REPLAY = False          # sample by TD error with sum-tree, else uniform
+PER_ALPHA = 0.6                     # priority exponent
+PER_BETA = 0.4                      # initial importance sampling exponent
+PER_BETA_INCREASE = 1e-4            # beta increase per batch, until 1
+PER_EPSILON = 1e-6                  # keep priority of zero error positive
 
 # IDQL hyper-parameter
 TOTAL_TIME_SLOT = 2000
+TRACE_CHUNK_SIZE = 100              # time slots of channel trace evaluated at once
 
 LEARNING_RATE = 1e-4                # optimizer learning rate
 EPSILON = 1                         # Greedy-Epsilon
@@ -96,6 +122,12 @@ EPSILON_DECREASE = 1e-4
 PRINT_SLOT = 100                     # print log every PRINT_SLOT
 TOP_PATH_LOSS = 9
 INTERFERENCE_PENALTY = 5
+REWARD_PENALTY = "SIGMOID"          # interference penalty of reward, SIGMOID or LOG
+
+# decoupled actor/learner training
+DECOUPLED_LEARNER = False           # train in a learner process on a shared memory pool
+LEARNER_SYNC_STEP = 50              # learner publishes weights every LEARNER_SYNC_STEP train steps
+ACTOR_SYNC_SLOT = 10                # actor loads published weights every ACTOR_SYNC_SLOT time slots
 
 # Q-network
 INPUT_LAYER = calInputLayer(CELL_NUMBER, CODEBOOK_SIZE)
@@ -106,6 +138,7 @@ HIDDEN_LAYER = [1024, 1024, 1024, 1024]
 MODEL_PATH = "./model/model.pth"
 SIMULATION_DATA_PATH = "simulation_data/data.txt"
 MOBILE_NETWORK_DATA_PATH = "./network_data/network.txt"
+TRACE_DATA_PATH = "./trace_data/"
 
 
 if __name__ == "__main__":
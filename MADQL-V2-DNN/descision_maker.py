@@ -3,6 +3,7 @@ from random_dm import Random
 from cell_es_dm import CellES
 from madql_dm import MADQL
 from max_power_dm import MaxPower
+from best_response_dm import BestResponse
 
 
 def setDecisionMaker(algorithm, loadModel=False):
@@ -14,5 +15,7 @@ def setDecisionMaker(algorithm, loadModel=False):
         return MADQL(loadModel)
     elif algorithm == Algorithm.CELL_ES:
         return CellES()
+    elif algorithm == Algorithm.BEST_RESPONSE:
+        return BestResponse()
     else:
         raise Exception("Incorrect algorithm setting: " + algorithm)
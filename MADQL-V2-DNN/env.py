@@ -1,43 +1,583 @@
+from scipy.spatial import cKDTree
+
 from config import *
-from channel_generator import generateChannel
-from utils import generateChannelIndex, SKIP_LIST
+from channel import ChannelView, calPathLossBatch, generatePathGeometry, generatePathGain, evolvePathGain, composeCSI
+from mobile_network_generator import calIsolationMask, calSiteIndex
+from mobility import Mobility
+from utils import dB2num, dBm2num, index2Action, buildCUIndexList
 
 
 class Environment:
-    def __init__(self, sectors, UEs):
-        self.channels = generateChannel(sectors, UEs)
-        self.topPathLossList = self._calTopPathLoss_()
+    def __init__(self, sectors, UEs, markovChannel=MARKOV_CHANNEL, trace=None, mobility=UE_MOBILITY):
+        self.linkNumber = len(sectors)
+        self.markovChannel = markovChannel
+        # channel store, index [transmitter, receiver]
+        self.sectorPositions = np.array([sector.getPosition() for sector in sectors], dtype=float)
+        self.UEPositions = np.array([UE.getPosition() for UE in UEs], dtype=float)
+        if trace is None:
+            self.trace = None
+            """shadowing is kept, so that path loss of moved UEs is recomputed with the same shadowing"""
+            self.shadowing = dB2num(SHADOWING_SIGMA * np.random.rand(self.linkNumber, self.linkNumber))
+            self.pathLoss = self._calPathLoss_()
+            self.AoA, self.AoD = generatePathGeometry(self.pathLoss.shape)
+            self.pathGain = generatePathGain(self.pathLoss.shape)
+            self.CSI = composeCSI(self.AoA, self.pathGain, self.AoD, self.pathLoss)
+        else:
+            """replay channel realizations recorded by recordTrace"""
+            self._loadTrace_(trace)
+        # per time slot cache, cleared in update
+        self.beamformedCSI = None
+        self.projection = None
+        self.interferenceGain = None
+        # index tables
+        self.CUIndexTable = np.array([buildCUIndexList(i) for i in range(self.linkNumber)])     # links * 3
+        self.isolationMask = calIsolationMask(sectors)                                         # links * links
+        self.interferenceMask = ~(self.isolationMask | np.eye(self.linkNumber, dtype=bool))    # links * links
+        self.topPathLossTable = self._calTopPathLoss_()                                        # links * N
+        if trace is not None:
+            self.topPathLossTable = np.array(self.traceTopPathLoss[0])
+        # UE mobility, not applied to replayed trace (recorded channels already follow moved UEs)
+        if mobility == "NONE" or trace is not None:
+            self.mobility = None
+        else:
+            self.mobility = Mobility(self.sectorPositions, self.UEPositions, model=mobility)
 
     def getChannel(self, transIndex, receiveIndex):
-        return self.channels[generateChannelIndex(transIndex, receiveIndex)]
+        return ChannelView(self.CSI[transIndex, receiveIndex], self.pathLoss[transIndex, receiveIndex])
+
+    def getCSI(self):
+        """return CSI of all channels, shape: [transmitter, receiver, UT_ANTENNA, BS_ANTENNA]"""
+        return self.CSI
+
+    def getPathLoss(self):
+        """return path loss of all channels, shape: [transmitter, receiver]"""
+        return self.pathLoss
+
+    def getBeamformedCSI(self):
+        """return H * f of all channels and beamformers, shape: [transmitter, receiver, UT_ANTENNA, CODEBOOK_SIZE]"""
+        if self.beamformedCSI is None:
+            self.beamformedCSI = np.matmul(self.CSI, BEAMFORMER_MATRIX)
+        return self.beamformedCSI
+
+    def getProjection(self):
+        """return ||H * f|| of all channels and beamformers, shape: [transmitter, receiver, CODEBOOK_SIZE]"""
+        if self.projection is None:
+            self.projection = np.linalg.norm(self.getBeamformedCSI(), axis=-2)
+        return self.projection
+
+    def getInterferenceGain(self):
+        """
+        return |(H_ii * b)^H * H_ji * f|^2 for receiver i, interferer j and all beamformer pairs (b, f),
+        zero when j is i or isolated from i, shape: [receiver, interferer, CODEBOOK_SIZE, CODEBOOK_SIZE]
+        """
+        if self.interferenceGain is None:
+            beamformedCSI = self.getBeamformedCSI()
+            linkIndex = np.arange(self.linkNumber)
+            directCSI = beamformedCSI[linkIndex, linkIndex].conjugate().swapaxes(-1, -2)
+            crossGain = np.matmul(np.expand_dims(directCSI, 1), beamformedCSI.swapaxes(0, 1))
+            self.interferenceGain = np.square(np.abs(crossGain)) * self.interferenceMask[:, :, None, None]
+        return self.interferenceGain
+
+    def getLinkProjection(self, transIndex, receiveIndex):
+        """||H * f|| of channels transIndex -> receiveIndex (broadcast), shape: index shape + [CODEBOOK_SIZE]"""
+        return self.getProjection()[transIndex, receiveIndex]
+
+    def getDirectProjection(self):
+        """||H_ii * f|| of all links, shape: [links, CODEBOOK_SIZE]"""
+        linkIndex = np.arange(self.linkNumber)
+        return self.getProjection()[linkIndex, linkIndex]
+
+    def getEdges(self):
+        """transmitter and receiver index of every channel, ordered by receiver, shape: [links * links]"""
+        linkIndex = np.arange(self.linkNumber)
+        return np.tile(linkIndex, self.linkNumber), np.repeat(linkIndex, self.linkNumber)
+
+    def getEdgeProjection(self):
+        """||H * f|| of every channel in getEdges order, shape: [links * links, CODEBOOK_SIZE]"""
+        return self.getProjection().swapaxes(0, 1).reshape(self.linkNumber * self.linkNumber, CODEBOOK_SIZE)
+
+    def calInterferencePower(self, power, beamformer):
+        """
+        interference power of every link under a batch of joint actions
+        Args:
+            power: transmit power, shape: [N, links]
+            beamformer: beamformer index, shape: [N, links]
+        Returns:
+            interference power, shape: [N, links]
+        """
+        linkIndex = np.arange(self.linkNumber)
+        interferenceGain = self.getInterferenceGain()[linkIndex[:, None], linkIndex,
+                                                      beamformer[..., :, None], beamformer[..., None, :]]
+        return np.matmul(interferenceGain, power[..., None])[..., 0]
+
+    def buildInterferenceAccumulator(self, actions):
+        return InterferenceAccumulator(self, actions)
 
     def getTopPathLossList(self, i):
         """return a list of link index"""
-        return self.topPathLossList[i]
+        return self.topPathLossTable[i]
+
+    def getTopPathLossTable(self):
+        """row i is getTopPathLossList(i), shape: [links, N]"""
+        return self.topPathLossTable
+
+    def getCUIndexTable(self):
+        """row i is buildCUIndexList(i), shape: [links, 3]"""
+        return self.CUIndexTable
+
+    def getIsolationMask(self):
+        """True if link i and j are isolated, shape: [links, links]"""
+        return self.isolationMask
+
+    def getInterferenceMask(self):
+        """True if link j interferes link i, shape: [receiver, interferer]"""
+        return self.interferenceMask
+
+    def getUEPositions(self):
+        """current UE positions, shape: [links, 3]"""
+        return self.UEPositions
 
     def update(self):
-        for channel in self.channels.values():
-            channel.update()
+        if self.trace is not None:
+            self._setTraceSlot_(self.traceSlot + 1)
+            return
+        self._moveUEs_()
+        self._updateFading_()
+        self.CSI = composeCSI(self.AoA, self.pathGain, self.AoD, self.pathLoss)
+        self._clearCache_()
+
+    def generateTrace(self, timeSlot, chunkSize=TRACE_CHUNK_SIZE):
+        """
+        Channels of timeSlot time slots from the current one, same as reading getCSI, getPathLoss and
+        getTopPathLossTable and calling update every slot, env is left at the time slot after the trace
+        Returns:
+            generator of chunks (CSI, path loss, top path loss table), shape:
+            [chunk, transmitter, receiver, UT_ANTENNA, BS_ANTENNA], [chunk, transmitter, receiver], [chunk, links, N]
+        """
+        if self.trace is not None:
+            yield from self._replayTrace_(timeSlot, chunkSize)
+            return
+        for start in range(0, timeSlot, chunkSize):
+            AoA, AoD, pathGain, pathLoss, topPathLossTable = [], [], [], [], []
+            for _ in range(min(chunkSize, timeSlot - start)):
+                AoA.append(self.AoA)
+                AoD.append(self.AoD)
+                pathGain.append(self.pathGain)
+                pathLoss.append(self.pathLoss)
+                """top path loss table is updated in place by UE mobility"""
+                topPathLossTable.append(self.topPathLossTable.copy())
+                self._moveUEs_()
+                self._updateFading_()
+            pathLoss = np.stack(pathLoss)
+            yield composeCSI(np.stack(AoA), np.stack(pathGain), np.stack(AoD), pathLoss), pathLoss, \
+                np.stack(topPathLossTable)
+        self.CSI = composeCSI(self.AoA, self.pathGain, self.AoD, self.pathLoss)
+        self._clearCache_()
+
+    def recordTrace(self, timeSlot, name="default"):
+        """
+        record channels of timeSlot time slots from the current one to memory-mapped .npy files in TRACE_DATA_PATH,
+        path loss and top path loss table of every time slot are recorded too (they change with UE mobility),
+        so that Environment(..., trace=name) replays the same channels
+        """
+        traces = []
+        for suffix, dtype, shape in [("-CSI.npy", self.CSI.dtype, self.CSI.shape),
+                                     ("-pathLoss.npy", self.pathLoss.dtype, self.pathLoss.shape),
+                                     ("-topPathLoss.npy", self.topPathLossTable.dtype, self.topPathLossTable.shape)]:
+            traces.append(np.lib.format.open_memmap(TRACE_DATA_PATH + name + suffix, mode="w+", dtype=dtype,
+                                                    shape=(timeSlot, *shape)))
+        start = 0
+        for chunks in self.generateTrace(timeSlot):
+            for trace, chunk in zip(traces, chunks):
+                trace[start:start + len(chunk)] = chunk
+            start += len(chunks[0])
+        for trace in traces:
+            trace.flush()
 
     def isIsolated(self, i, j):
-        return j in SKIP_LIST[i]
+        return self.isolationMask[i, j]
 
     def isDirectLink(self, i, j):
         return i == j
 
+    def _moveUEs_(self):
+        """move UEs, path loss and top path loss list are updated only for receivers of moved UEs"""
+        if self.mobility is None:
+            return
+        moved = self.mobility.step()
+        if len(moved) == 0:
+            return
+        self.UEPositions[moved] = self.mobility.getPositions()[moved]
+        pathLoss = self.pathLoss.copy()
+        pathLoss[:, moved] = self._calPathLoss_(moved)
+        self.pathLoss = pathLoss
+        self._updateTopPathLoss_(moved)
+
+    def _updateFading_(self):
+        if self.markovChannel:
+            """keep AoA/AoD, only path gain changes"""
+            self.pathGain = evolvePathGain(self.pathGain)
+        else:
+            self.AoA, self.AoD = generatePathGeometry(self.pathLoss.shape)
+            self.pathGain = generatePathGain(self.pathLoss.shape)
+
+    def _clearCache_(self):
+        self.beamformedCSI = None
+        self.projection = None
+        self.interferenceGain = None
+
+    def _loadTrace_(self, name):
+        self.trace = np.load(TRACE_DATA_PATH + name + "-CSI.npy", mmap_mode="r")
+        if self.trace.shape[1] != self.linkNumber:
+            raise Exception(f"Channel trace {name} has {self.trace.shape[1]} links, network has {self.linkNumber}")
+        self.tracePathLoss = np.load(TRACE_DATA_PATH + name + "-pathLoss.npy", mmap_mode="r")
+        self.traceTopPathLoss = np.load(TRACE_DATA_PATH + name + "-topPathLoss.npy", mmap_mode="r")
+        self.AoA, self.AoD, self.pathGain = None, None, None
+        self.traceSlot = 0
+        self.pathLoss = np.array(self.tracePathLoss[0])
+        self.CSI = np.asarray(self.trace[0])
+
+    def _setTraceSlot_(self, slot):
+        """moving to the end of trace is a no-op (update after the last time slot), reading past it raises"""
+        if slot > len(self.trace):
+            raise Exception(f"Channel trace has only {len(self.trace)} time slots")
+        self.traceSlot = slot
+        if slot == len(self.trace):
+            return
+        self.CSI = np.asarray(self.trace[slot])
+        self.pathLoss = np.array(self.tracePathLoss[slot])
+        self.topPathLossTable = np.array(self.traceTopPathLoss[slot])
+        self._clearCache_()
+
+    def _replayTrace_(self, timeSlot, chunkSize):
+        """generateTrace on a recorded trace, chunks are read from the memory-mapped file"""
+        end = self.traceSlot + timeSlot
+        if end > len(self.trace):
+            raise Exception(f"Channel trace has only {len(self.trace)} time slots")
+        for start in range(self.traceSlot, end, chunkSize):
+            chunk = slice(start, min(start + chunkSize, end))
+            yield np.asarray(self.trace[chunk]), np.asarray(self.tracePathLoss[chunk]), \
+                np.asarray(self.traceTopPathLoss[chunk])
+        self._setTraceSlot_(end)
+
+    def _calPathLoss_(self, receiveIndex=slice(None)):
+        """path loss of channels from all sectors to UEs receiveIndex, shape: [links, len(receiveIndex)]"""
+        distance = np.linalg.norm(self.sectorPositions[:, None] - self.UEPositions[None, receiveIndex], axis=-1)
+        return (1 / np.sqrt(np.power(distance, ALPHA) + self.shadowing[:, receiveIndex])).astype(FLOAT_DTYPE)
+
+    def _calTopPathLoss_(self):
+        """top N j->i path loss, ascending order, direct and isolated links are excluded, full order is kept"""
+        pathLoss = np.where(self.interferenceMask, self.pathLoss.T, np.inf)
+        candidateNumber = np.min(np.sum(self.interferenceMask, axis=1))
+        self.pathLossOrder = np.argsort(pathLoss, axis=1, kind="stable")
+        return self.pathLossOrder[:, :min(TOP_PATH_LOSS, candidateNumber)]
+
+    def _updateTopPathLoss_(self, receiveIndex):
+        """re-sort rows receiveIndex starting from their last order, which is nearly sorted after a small move"""
+        order = self.pathLossOrder[receiveIndex]
+        pathLoss = np.where(self.interferenceMask[receiveIndex[:, None], order],
+                            self.pathLoss[order, receiveIndex[:, None]], np.inf)
+        self.pathLossOrder[receiveIndex] = np.take_along_axis(order, np.argsort(pathLoss, axis=1, kind="stable"),
+                                                              axis=1)
+        self.topPathLossTable[receiveIndex] = self.pathLossOrder[receiveIndex, :self.topPathLossTable.shape[1]]
+
+
+class BatchEnvironment:
+    """
+    Independent mobile networks of the same number of links stepped at once, channel store is stacked with index
+    [network, transmitter, receiver], every network keeps an Environment whose channel store is a view of it
+    """
+
+    def __init__(self, networks, markovChannel=MARKOV_CHANNEL):
+        self.envs = [Environment(sectors, UEs, markovChannel, mobility="NONE") for sectors, UEs in networks]
+        self.networkNumber = len(self.envs)
+        self.linkNumber = self.envs[0].linkNumber
+        if any(env.linkNumber != self.linkNumber for env in self.envs):
+            raise Exception("All mobile networks of BatchEnvironment must have the same number of links")
+        self.markovChannel = markovChannel
+        # stacked channel store
+        self.pathLoss = np.stack([env.getPathLoss() for env in self.envs])
+        self.AoA = np.stack([env.AoA for env in self.envs])
+        self.AoD = np.stack([env.AoD for env in self.envs])
+        self.pathGain = np.stack([env.pathGain for env in self.envs])
+        self.CSI = composeCSI(self.AoA, self.pathGain, self.AoD, self.pathLoss)
+        self.beamformedCSI = None
+        self.projection = None
+        self._linkEnvironments_()
+        # stacked index tables
+        self.CUIndexTable = np.stack([env.getCUIndexTable() for env in self.envs])               # E * links * 3
+        self.topPathLossTable = np.stack([env.getTopPathLossTable() for env in self.envs])       # E * links * N
+
+    def getEnvironments(self):
+        return self.envs
+
+    def getCSI(self):
+        """shape: [network, transmitter, receiver, UT_ANTENNA, BS_ANTENNA]"""
+        return self.CSI
+
+    def getPathLoss(self):
+        """shape: [network, transmitter, receiver]"""
+        return self.pathLoss
+
+    def getBeamformedCSI(self):
+        """shape: [network, transmitter, receiver, UT_ANTENNA, CODEBOOK_SIZE]"""
+        if self.beamformedCSI is None:
+            self.beamformedCSI = np.matmul(self.CSI, BEAMFORMER_MATRIX)
+            for index, env in enumerate(self.envs):
+                env.beamformedCSI = self.beamformedCSI[index]
+        return self.beamformedCSI
+
+    def getProjection(self):
+        """shape: [network, transmitter, receiver, CODEBOOK_SIZE]"""
+        if self.projection is None:
+            self.projection = np.linalg.norm(self.getBeamformedCSI(), axis=-2)
+            for index, env in enumerate(self.envs):
+                env.projection = self.projection[index]
+        return self.projection
+
+    def getTopPathLossTable(self):
+        """shape: [network, links, N]"""
+        return self.topPathLossTable
+
+    def getCUIndexTable(self):
+        """shape: [network, links, 3]"""
+        return self.CUIndexTable
+
+    def update(self):
+        """same as Environment.update, drawn for all networks at once"""
+        if self.markovChannel:
+            self.pathGain = evolvePathGain(self.pathGain)
+        else:
+            self.AoA, self.AoD = generatePathGeometry(self.pathLoss.shape)
+            self.pathGain = generatePathGain(self.pathLoss.shape)
+        self.CSI = composeCSI(self.AoA, self.pathGain, self.AoD, self.pathLoss)
+        self.beamformedCSI = None
+        self.projection = None
+        self._linkEnvironments_()
+
+    def _linkEnvironments_(self):
+        """point channel store of every Environment to its slice of the stacked store"""
+        for index, env in enumerate(self.envs):
+            env.AoA = self.AoA[index]
+            env.AoD = self.AoD[index]
+            env.pathGain = self.pathGain[index]
+            env.CSI = self.CSI[index]
+            env._clearCache_()
+
+
+class SparseEnvironment:
+    """
+    Environment of large networks, UE i only keeps channels from sectors within interferenceRadius, its CU and
+    its farthest sectors, stored per edge in CSR order of receiver, channels not kept cause no interference,
+    top path loss list of UE i is chosen among its kept interferers in the same ascending order as Environment
+    """
+
+    def __init__(self, sectors, UEs, markovChannel=MARKOV_CHANNEL, interferenceRadius=INTERFERENCE_RADIUS):
+        self.linkNumber = len(sectors)
+        self.markovChannel = markovChannel
+        self.siteIndex = calSiteIndex(sectors)
+        self.CUIndexTable = np.array([buildCUIndexList(i) for i in range(self.linkNumber)])     # links * 3
+        # channel store, edge e is channel transmitter[e] -> receiver[e]
+        self.indptr, self.transmitter = self._calNeighbors_(sectors, UEs, interferenceRadius)
+        self.receiver = np.repeat(np.arange(self.linkNumber), np.diff(self.indptr))
+        self.edgeKey = self.receiver * self.linkNumber + self.transmitter                      # sorted
+        self.directEdge = self.getEdgeIndex(np.arange(self.linkNumber), np.arange(self.linkNumber))
+        self.interferenceEdge = ~(self.isDirectLink(self.transmitter, self.receiver)
+                                  | self.isIsolated(self.transmitter, self.receiver))
+        self.pathLoss = self._calPathLoss_(sectors, UEs)
+        self.AoA, self.AoD = generatePathGeometry(self.pathLoss.shape)
+        self.pathGain = generatePathGain(self.pathLoss.shape)
+        self.CSI = composeCSI(self.AoA, self.pathGain, self.AoD, self.pathLoss)
+        # per time slot cache, cleared in update
+        self.beamformedCSI = None
+        self.projection = None
+        self.topPathLossTable = self._calTopPathLoss_()                                        # links * N
+
+    def getEdges(self):
+        """transmitter and receiver index of every kept channel, ordered by receiver, shape: [edges]"""
+        return self.transmitter, self.receiver
+
+    def getEdgeIndex(self, transIndex, receiveIndex):
+        """edge index of channels transIndex -> receiveIndex (broadcast), raise if a channel is not kept"""
+        key = np.asarray(receiveIndex) * self.linkNumber + np.asarray(transIndex)
+        edgeIndex = np.minimum(np.searchsorted(self.edgeKey, key), len(self.edgeKey) - 1)
+        if np.any(self.edgeKey[edgeIndex] != key):
+            raise Exception("Channel is not kept in SparseEnvironment")
+        return edgeIndex
+
+    def getCSI(self):
+        """CSI of every kept channel, shape: [edges, UT_ANTENNA, BS_ANTENNA]"""
+        return self.CSI
+
+    def getPathLoss(self):
+        """path loss of every kept channel, shape: [edges]"""
+        return self.pathLoss
+
+    def getBeamformedCSI(self):
+        """shape: [edges, UT_ANTENNA, CODEBOOK_SIZE]"""
+        if self.beamformedCSI is None:
+            self.beamformedCSI = np.matmul(self.CSI, BEAMFORMER_MATRIX)
+        return self.beamformedCSI
+
+    def getEdgeProjection(self):
+        """||H * f|| of every kept channel, shape: [edges, CODEBOOK_SIZE]"""
+        if self.projection is None:
+            self.projection = np.linalg.norm(self.getBeamformedCSI(), axis=-2)
+        return self.projection
+
+    def getLinkProjection(self, transIndex, receiveIndex):
+        """same as Environment.getLinkProjection, channels must be kept"""
+        return self.getEdgeProjection()[self.getEdgeIndex(transIndex, receiveIndex)]
+
+    def getDirectProjection(self):
+        return self.getEdgeProjection()[self.directEdge]
+
+    def calInterferencePower(self, power, beamformer):
+        """same as Environment.calInterferencePower, only kept channels are summed"""
+        beamformedCSI = self.getBeamformedCSI().swapaxes(-1, -2)                   # edges * CODEBOOK_SIZE * UT
+        directCSI = beamformedCSI[self.directEdge]
+        receivedCSI = directCSI[self.receiver, beamformer[..., self.receiver]]      # N * edges * UT
+        interferenceCSI = beamformedCSI[np.arange(len(self.transmitter)), beamformer[..., self.transmitter]]
+        crossGain = np.sum(receivedCSI.conjugate() * interferenceCSI, axis=-1)
+        interferencePower = np.square(np.abs(crossGain)) * power[..., self.transmitter] * self.interferenceEdge
+        return np.add.reduceat(interferencePower, self.indptr[:-1], axis=-1)
+
+    def getTopPathLossList(self, i):
+        return self.topPathLossTable[i]
+
+    def getTopPathLossTable(self):
+        return self.topPathLossTable
+
+    def getCUIndexTable(self):
+        return self.CUIndexTable
+
+    def update(self):
+        if self.markovChannel:
+            """keep AoA/AoD, only path gain changes"""
+            self.pathGain = evolvePathGain(self.pathGain)
+        else:
+            self.AoA, self.AoD = generatePathGeometry(self.pathLoss.shape)
+            self.pathGain = generatePathGain(self.pathLoss.shape)
+        self.CSI = composeCSI(self.AoA, self.pathGain, self.AoD, self.pathLoss)
+        self.beamformedCSI = None
+        self.projection = None
+
+    def isIsolated(self, i, j):
+        return (self.siteIndex[i] == self.siteIndex[j]) & (np.asarray(i) != np.asarray(j))
+
+    def isDirectLink(self, i, j):
+        return np.asarray(i) == np.asarray(j)
+
+    def _calNeighbors_(self, sectors, UEs, interferenceRadius):
+        """
+        transmitters of every receiver: within interferenceRadius from a k-d tree of sector positions, its CU and
+        farthest TOP_PATH_LOSS + 3, the top path loss list of Environment (smallest path loss first) is made of the
+        farthest sectors, shadowing is negligible at that distance
+        Returns:
+            CSR row pointer, shape: [links + 1]
+            transmitter index, ascending in every row, shape: [edges]
+        """
+        sectorPositions = np.array([sector.getPosition() for sector in sectors])[:, :2]
+        UEPositions = np.array([UE.getPosition() for UE in UEs])[:, :2]
+        tree = cKDTree(sectorPositions)
+        inRadius = tree.query_ball_point(UEPositions, r=interferenceRadius)
+        # farthest sectors in blocks of receivers, a links * links distance matrix is never built
+        farthestNumber = min(self.linkNumber, TOP_PATH_LOSS + 3)
+        farthest = []
+        for start in range(0, self.linkNumber, 1024):
+            distance = np.linalg.norm(UEPositions[start:start + 1024, None] - sectorPositions[None], axis=-1)
+            farthest.append(np.argpartition(-distance, farthestNumber - 1, axis=1)[:, :farthestNumber])
+        farthest = np.concatenate(farthest)
+        neighbors = [np.unique(np.concatenate([inRadius[i], farthest[i], self.CUIndexTable[i]]).astype(int))
+                     for i in range(self.linkNumber)]
+        indptr = np.concatenate([[0], np.cumsum([len(neighbor) for neighbor in neighbors])])
+        return indptr, np.concatenate(neighbors)
+
+    def _calPathLoss_(self, sectors, UEs):
+        sectorPositions = np.array([sector.getPosition() for sector in sectors])
+        UEPositions = np.array([UE.getPosition() for UE in UEs])
+        distance = np.linalg.norm(sectorPositions[self.transmitter] - UEPositions[self.receiver], axis=1)
+        return calPathLossBatch(distance)
+
     def _calTopPathLoss_(self):
-        """top N j->i path loss"""
-        topPathLossList = {}
-        for i in range(3 * CELL_NUMBER):
-            # get list of (link index, path loss)
-            pathLoss = []
-            for j in range(3 * CELL_NUMBER):
-                if self.isDirectLink(i, j) or self.isIsolated(i, j):
-                    continue
-                else:
-                    pathLoss.append((j, self.getChannel(j, i).getPathLoss()))
-            # sort
-            sortedPathLoss = sorted(pathLoss, key=lambda tup: tup[1])
-            linkIndexes = [pathLoss[0] for pathLoss in sortedPathLoss[0:TOP_PATH_LOSS]]
-            topPathLossList[i] = linkIndexes
-        return topPathLossList
+        """same order as Environment, candidates are kept interferers"""
+        pathLoss = np.where(self.interferenceEdge, self.pathLoss, np.inf)
+        order = np.lexsort((self.transmitter, pathLoss, self.receiver))
+        candidateNumber = np.min(np.add.reduceat(self.interferenceEdge.astype(int), self.indptr[:-1]))
+        width = min(TOP_PATH_LOSS, candidateNumber)
+        return self.transmitter[order][self.indptr[:-1, None] + np.arange(width)]
+
+
+class InterferenceAccumulator:
+    """
+    Per-link signal, noise and interference power of a joint action under current CSI of env,
+    action change of a single link is applied in O(links), call refresh after env.update
+    """
+
+    def __init__(self, env, actions):
+        self.env = env
+        self.linkIndex = np.arange(env.linkNumber)
+        self.powerList = dBm2num(np.asarray(POWER_LIST, dtype=FLOAT_DTYPE))
+        self.actionList = np.array([index2Action(actionIndex) for actionIndex in range(OUTPUT_LAYER)])
+        self.refresh(actions)
+
+    def refresh(self, actions=None):
+        """recompute all terms from scratch in O(links^2), also removes accumulated rounding error"""
+        if actions is not None:
+            self.actions = np.array(actions)
+        self.power = self.powerList[self.actions[:, 0]]
+        self.beamformer = self.actions[:, 1].copy()
+        directProjection = self.env.getProjection()[self.linkIndex, self.linkIndex, self.beamformer]
+        self.signalPower = self.power * np.power(directProjection, 4)
+        self.noisePower = dBm2num(NOISE_POWER) * np.power(directProjection, 2)
+        interferenceGain = self.env.getInterferenceGain()[self.linkIndex[:, None], self.linkIndex,
+                                                          self.beamformer[:, None], self.beamformer]
+        self.interferencePower = np.matmul(interferenceGain, self.power)
+
+    def getActions(self):
+        return self.actions.tolist()
+
+    def getCapacity(self):
+        return np.log2(1 + self.signalPower / (self.noisePower + self.interferencePower))
+
+    def setAction(self, index, action):
+        """change action of link index to [power index, beamformer index]"""
+        interferenceGain = self.env.getInterferenceGain()
+        power = self.powerList[action[0]]
+        beamformer = action[1]
+        # interference caused by link index on other links (gain of link index on itself is 0)
+        self.interferencePower += power * interferenceGain[self.linkIndex, index, self.beamformer, beamformer] \
+            - self.power[index] * interferenceGain[self.linkIndex, index, self.beamformer, self.beamformer[index]]
+        self.actions[index] = action
+        self.power[index] = power
+        self.beamformer[index] = beamformer
+        # terms of link index itself
+        directProjection = self.env.getProjection()[index, index, beamformer]
+        self.signalPower[index] = power * np.power(directProjection, 4)
+        self.noisePower[index] = dBm2num(NOISE_POWER) * np.power(directProjection, 2)
+        self.interferencePower[index] = np.dot(
+            interferenceGain[index, self.linkIndex, beamformer, self.beamformer], self.power)
+
+    def calLinkActionCapacity(self, index):
+        """
+        capacity of all links for every action of link index while other links keep their actions, O(links)
+        per action
+        Returns:
+            capacity, shape: [OUTPUT_LAYER, links], row is action index (same as index2Action)
+        """
+        interferenceGain = self.env.getInterferenceGain()
+        power = self.powerList[self.actionList[:, 0]]
+        beamformer = self.actionList[:, 1]
+        # other links: replace interference caused by link index
+        causedGain = interferenceGain[self.linkIndex, index, self.beamformer, :]
+        interferencePower = self.interferencePower - self.power[index] * causedGain[:, self.beamformer[index]] \
+            + power[:, None] * causedGain[:, beamformer].T
+        signalPower = np.tile(self.signalPower, (OUTPUT_LAYER, 1))
+        noisePower = np.tile(self.noisePower, (OUTPUT_LAYER, 1))
+        # link index itself
+        directProjection = self.env.getProjection()[index, index, beamformer]
+        signalPower[:, index] = power * np.power(directProjection, 4)
+        noisePower[:, index] = dBm2num(NOISE_POWER) * np.power(directProjection, 2)
+        receivedGain = interferenceGain[index, self.linkIndex, :, self.beamformer]
+        interferencePower[:, index] = np.matmul(self.power, receivedGain)[beamformer]
+        return np.log2(1 + signalPower / (noisePower + interferencePower))
@@ -1,4 +1,5 @@
 import logging
+import time
 
 import torch.nn as nn
 import torch.optim
@@ -7,7 +8,7 @@ import torch.nn.functional as F
 
 from config import *
 from memory_pool import MemoryPool
-from utils import Algorithm, calCapacity, action2Index, index2Action, buildCUIndexList, dBm2num, sigmoid, saveData
+from utils import Algorithm, calCapacity, action2Index, index2Action, dBm2num, sigmoid, saveData
 from random_dm import takeActionRandom
 
 
@@ -28,8 +29,54 @@ class DQN(nn.Module):
         return self.output_layer(out)
 
 
+def trainStep(dqn, optimizer, lossFunction, memoryPool, batchSize, device):
+    """one gradient step of dqn on a batch of memoryPool, return loss value"""
+    x, y, actions, index, weights = memoryPool.getBatch(batchSize)
+    x = x.to(device)
+    y = y.to(device)
+    actions = actions.to(device)
+    optimizer.zero_grad()
+    dqn.zero_grad()
+    y_predict = dqn(x)
+    if weights is None:
+        loss = lossFunction(y_predict, y)
+    else:
+        # importance sampling weighted MSE, priority from per-sample TD error |Q(s, a) - r| of the taken action
+        loss = torch.mean(weights[:, None] * torch.square(y_predict - y))
+        rows = torch.arange(len(actions), device=device)
+        memoryPool.updatePriority(index, torch.abs(y_predict[rows, actions] - y[rows, actions]).detach())
+    loss.backward()
+    optimizer.step()
+    return loss.item()
+
+
+def learnerProcess(memoryPool, sharedDQN, sharedLock, readyEvent, stopEvent, learnerRecord, batchSize, device):
+    """
+    Learner of decoupled training, trains on the shared memory pool and publishes weights to sharedDQN
+    every LEARNER_SYNC_STEP steps, learnerRecord is [train slot, accumulate loss], readyEvent is set once it is built
+    """
+    dqn = DQN(INPUT_LAYER, OUTPUT_LAYER)
+    dqn.load_state_dict(sharedDQN.state_dict())
+    dqn.to(device)
+    optimizer = torch.optim.Adam(dqn.parameters(), lr=LEARNING_RATE)
+    lossFunction = nn.MSELoss()
+    readyEvent.set()
+    while not stopEvent.is_set():
+        if memoryPool.getSize() <= batchSize:
+            time.sleep(0.01)
+            continue
+        loss = trainStep(dqn, optimizer, lossFunction, memoryPool, batchSize, device)
+        learnerRecord[0] += 1
+        learnerRecord[1] += loss
+        if int(learnerRecord[0]) % LEARNER_SYNC_STEP == 0:
+            with sharedLock:
+                sharedDQN.load_state_dict(dqn.state_dict())
+    with sharedLock:
+        sharedDQN.load_state_dict(dqn.state_dict())
+
+
 class MADQL:
-    def __init__(self, loadModel):
+    def __init__(self, loadModel, decoupled=DECOUPLED_LEARNER):
         self.logger = logging.getLogger()
         self.algorithm = Algorithm.MADQL
         self.epsilon = EPSILON
@@ -47,17 +94,24 @@ class MADQL:
         # set optimizer and loss
         self.optimizer = torch.optim.Adam(self.DQN.parameters(), lr=LEARNING_RATE)
         self.loss = nn.MSELoss()
-        # memory pool
-        self.memoryPool = MemoryPool()
+        # memory pool, a record of CELL_NUMBER rows in the old list memory is kept as rows
+        # decoupled learner shares the memory pool in CPU shared memory
+        self.batchSize = BATCH_SIZE * (self.linkNumber // 3)
+        self.decoupled = decoupled
+        self.memoryPool = MemoryPool(capacity=MP_MAX_SIZE * (self.linkNumber // 3),
+                                     device="cpu" if decoupled else self.device)
         # update network
         self.trainSlot = 0
         self.accumulateLoss = 0.
+        # decoupled learner
+        self.learner = None
+        self.actorSlot = 0
         # temp record
         self.averageRewardPenalties = []
 
     def epsilonGreedyPolicy(self, outputs, trainNetwork):
         actions = []
-        if np.random.rand() < self.epsilon and trainNetwork:
+        if trainNetwork and np.random.rand() < self.epsilon:
             actions = takeActionRandom(self.linkNumber)
         else:
             for index in range(self.linkNumber):
@@ -66,47 +120,53 @@ class MADQL:
         return actions
 
     def calReward(self, actions, env):
-        capacities = calCapacity(actions, env)
-        rewards = [0. for _ in range(self.linkNumber)]
-        sumRewardPenalty = 0.
-        for i in range(len(rewards)):
-            indexes = buildCUIndexList(i)
-            for index in indexes:
-                rewards[i] += capacities[index]
-            rewards[i] /= 3
-            rewardPenalty = self.calInterferencePenaltySig(actions, env, i)
-            sumRewardPenalty += rewardPenalty
-            rewards[i] = rewards[i] - INTERFERENCE_PENALTY * rewardPenalty
-            # append reward penalty -> use for record
-            self.averageRewardPenalties.append(rewardPenalty)
-        return rewards
-
-    def calInterferencePenaltySig(self, actions, env, index):
-        rewardPenalty = 0.
-        beamformer = BEAMFORMER_LIST[actions[index][1]]
-        for j in range(self.linkNumber):
-            if env.isDirectLink(j, index) and env.isIsolated(index, j):
-                continue
-            else:
-                channel = env.getChannel(index, j).getCSI()
-                rewardPenalty += np.linalg.norm(np.matmul(channel, beamformer))
-        rewardPenalty = sigmoid(rewardPenalty)
-        return rewardPenalty
-
-    def calInterferencePenaltyLog(self, actions, env, index):
-        """log2"""
-        rewardPenalty = 0.
-        power = dBm2num(POWER_LIST[actions[index][0]])
-        beamformer = BEAMFORMER_LIST[actions[index][1]]
-        for j in range(self.linkNumber):
-            if env.isDirectLink(j, index) and env.isIsolated(index, j):
-                continue
-            else:
-                channel = env.getChannel(index, j).getCSI()
-                rewardPenalty += np.log2(1+power * np.power(np.linalg.norm(np.matmul(channel, beamformer)), 2)
-                                         / dBm2num(NOISE_POWER))
-        rewardPenalty /= self.linkNumber - 1
-        return rewardPenalty
+        rewards, rewardPenalties = self.calRewardBatch(actions, env)
+        # append reward penalty -> use for record
+        self.averageRewardPenalties.extend(rewardPenalties.tolist())
+        return rewards.tolist()
+
+    def calRewardBatch(self, actions, env, penalty=REWARD_PENALTY):
+        """
+        Returns:
+            reward of all links, shape: [links], CU average capacity minus INTERFERENCE_PENALTY * penalty
+            reward penalty of all links, shape: [links]
+        """
+        capacities = np.asarray(calCapacity(actions, env), dtype=FLOAT_DTYPE)
+        rewards = np.sum(capacities[env.getCUIndexTable()], axis=1) / 3
+        if penalty == "SIGMOID":
+            rewardPenalties = self.calInterferencePenaltySig(actions, env)
+        elif penalty == "LOG":
+            rewardPenalties = self.calInterferencePenaltyLog(actions, env)
+        else:
+            raise Exception("Incorrect reward penalty setting: " + penalty)
+        return rewards - INTERFERENCE_PENALTY * rewardPenalties, rewardPenalties
+
+    def calOutgoingProjection(self, actions, env):
+        """
+        ||H_ij * f_i|| of every channel i -> j of env, masked entries are 0
+        Returns:
+            projection, shape: [edges]
+            transmitter index, shape: [edges]
+        """
+        beamformer = np.asarray(actions)[:, 1]
+        transmitter, receiver = env.getEdges()
+        projection = env.getEdgeProjection()[np.arange(len(transmitter)), beamformer[transmitter]]
+        mask = ~(env.isDirectLink(transmitter, receiver) & env.isIsolated(transmitter, receiver))
+        return projection * mask, transmitter
+
+    def calInterferencePenaltySig(self, actions, env):
+        """sigmoid, shape: [links]"""
+        projection, transmitter = self.calOutgoingProjection(actions, env)
+        rewardPenalty = np.bincount(transmitter, weights=projection, minlength=self.linkNumber).astype(FLOAT_DTYPE)
+        return sigmoid(rewardPenalty)
+
+    def calInterferencePenaltyLog(self, actions, env):
+        """log2, shape: [links]"""
+        power = dBm2num(np.asarray(POWER_LIST, dtype=FLOAT_DTYPE))[np.asarray(actions)[:, 0]]
+        projection, transmitter = self.calOutgoingProjection(actions, env)
+        rewardPenalty = np.log2(1 + power[transmitter] * np.power(projection, 2) / dBm2num(NOISE_POWER))
+        rewardPenalty = np.bincount(transmitter, weights=rewardPenalty, minlength=self.linkNumber).astype(FLOAT_DTYPE)
+        return rewardPenalty / (self.linkNumber - 1)
 
     def decreaseEpsilon(self):
         self.epsilon = max(self.epsilon / (1 + EPSILON_DECREASE), EPSILON_MIN)
@@ -119,69 +179,186 @@ class MADQL:
 
     def takeAction(self, env, trainNetwork):
         # build state and forward
-        states = np.zeros([self.linkNumber, INPUT_LAYER], dtype=float)
-        for index in range(self.linkNumber):
-            states[index, :] = self.buildState(index, env)
+        states = self.buildStates(env)
         with torch.no_grad():
-            outputs = self.DQN(torch.from_numpy(states).float().to(self.device)).cpu().detach().numpy()
+            outputs = self.DQN(torch.from_numpy(states).to(self.device, dtype=torch.float32)).cpu().detach().numpy()
         # take action
         actions = self.epsilonGreedyPolicy(outputs, trainNetwork)
         if trainNetwork:
             # calculate reward and update Q value
             rewards = self.calReward(actions, env)
-            for index in range(self.linkNumber):
-                outputs[index, action2Index(actions[index])] = rewards[index]
-            states = np.split(states, 3)
-            outputs = np.split(outputs, 3)
-            self.memoryPool.push([[state, output] for state, output in zip(states, outputs)])
+            actionIndex = [action2Index(action) for action in actions]
+            outputs[np.arange(self.linkNumber), actionIndex] = rewards
+            self.memoryPool.push(states, outputs, actionIndex)
+            # train
+            if self.decoupled:
+                self.syncLearner()
+            else:
+                self.train()
+
+        return actions
+
+    def takeActionBatch(self, batchEnv, trainNetwork):
+        """
+        takeAction for every mobile network of BatchEnvironment, agents of all networks share one forward
+        Returns:
+            actions of every network, network number * links * 2
+        """
+        # build state and forward
+        states = self.buildStatesBatch(batchEnv)
+        with torch.no_grad():
+            outputs = self.DQN(torch.from_numpy(states).to(self.device, dtype=torch.float32)).cpu().detach().numpy()
+        outputs = outputs.reshape(batchEnv.networkNumber, self.linkNumber, OUTPUT_LAYER)
+        # take action
+        actions = [self.epsilonGreedyPolicy(outputs[index], trainNetwork) for index in range(batchEnv.networkNumber)]
+        if trainNetwork:
+            # calculate reward and update Q value
+            actionIndex = np.array([[action2Index(action) for action in networkActions] for networkActions in actions])
+            for networkIndex, env in enumerate(batchEnv.getEnvironments()):
+                rewards = self.calReward(actions[networkIndex], env)
+                outputs[networkIndex, np.arange(self.linkNumber), actionIndex[networkIndex]] = rewards
+            self.memoryPool.push(states, outputs.reshape(-1, OUTPUT_LAYER), actionIndex.reshape(-1))
             # train
-            self.train()
+            if self.decoupled:
+                self.syncLearner()
+            else:
+                self.train()
 
         return actions
 
     def buildState(self, index, env):
         """use CSI to build state of link index"""
-        state = np.zeros(INPUT_LAYER, dtype=float)
+        state = np.zeros(INPUT_LAYER, dtype=FLOAT_DTYPE)
         # local information
-        indexes = buildCUIndexList(index)
+        indexes = env.getCUIndexTable()[index]
         count = 0
         for i in range(3):
             for j in range(3):
-                for k in range(CODEBOOK_SIZE):
-                    channel = env.getChannel(indexes[i], indexes[j]).getCSI()
-                    beamformer = BEAMFORMER_LIST[k]
-                    state[count] = np.linalg.norm(np.matmul(channel, beamformer))
-                    count += 1
+                state[count:count + CODEBOOK_SIZE] = env.getLinkProjection(indexes[i], indexes[j])
+                count += CODEBOOK_SIZE
         # exchanged information
         if CELL_NUMBER > 1:
             indexList = env.getTopPathLossList(index)
             for otherIndex in indexList:
-                for k in range(CODEBOOK_SIZE):
-                    channel = env.getChannel(otherIndex, index).getCSI()
-                    beamformer = BEAMFORMER_LIST[k]
-                    state[count] = np.linalg.norm(np.matmul(channel, beamformer))
-                    count += 1
+                state[count:count + CODEBOOK_SIZE] = env.getLinkProjection(otherIndex, index)
+                count += CODEBOOK_SIZE
         return state / np.max(state)
 
+    def buildStates(self, env):
+        """use CSI to build states of all links at once, row index is the same as buildState(index, env)"""
+        linkIndex = np.arange(self.linkNumber)
+        # local information
+        CUIndexes = env.getCUIndexTable()
+        states = [env.getLinkProjection(CUIndexes[:, :, None], CUIndexes[:, None, :]).reshape(self.linkNumber, -1)]
+        # exchanged information
+        if CELL_NUMBER > 1:
+            topIndexes = env.getTopPathLossTable()
+            states.append(env.getLinkProjection(topIndexes, linkIndex[:, None]).reshape(self.linkNumber, -1))
+        states = np.concatenate(states, axis=1)
+        return states / np.max(states, axis=1, keepdims=True)
+
+    def buildStatesBatch(self, batchEnv):
+        """buildStates of every network of BatchEnvironment, shape: [network number * links, INPUT_LAYER]"""
+        return self._gatherStates_(batchEnv.getProjection(), batchEnv.getCUIndexTable(),
+                                   batchEnv.getTopPathLossTable())
+
+    def takeActionTrace(self, CSI, topPathLossTable, env):
+        """
+        greedy actions of all time slots of a channel trace of env, actions never change channels in test
+        Args:
+            CSI: channel trace, shape: [T, transmitter, receiver, UT_ANTENNA, BS_ANTENNA]
+            topPathLossTable: top path loss table of every time slot, shape: [T, links, N]
+        Returns:
+            actions, shape: [T, links, 2]
+        """
+        projection = np.linalg.norm(np.matmul(CSI, BEAMFORMER_MATRIX), axis=-2)
+        states = self._gatherStates_(projection, env.getCUIndexTable()[None], topPathLossTable)
+        with torch.no_grad():
+            outputs = self.DQN(torch.from_numpy(states).to(self.device, dtype=torch.float32)).cpu().detach().numpy()
+        actionIndex = np.argmax(outputs, axis=1).reshape(len(CSI), self.linkNumber)
+        return np.stack([actionIndex // CODEBOOK_SIZE, actionIndex % CODEBOOK_SIZE], axis=-1)
+
+    def _gatherStates_(self, projection, CUIndexes, topIndexes):
+        """
+        buildStates of a batch of projections, index tables are broadcast along the batch
+        Args:
+            projection: shape: [N, transmitter, receiver, CODEBOOK_SIZE]
+            CUIndexes: shape: [N or 1, links, 3]
+            topIndexes: shape: [N or 1, links, TOP_PATH_LOSS]
+        Returns:
+            states, shape: [N * links, INPUT_LAYER]
+        """
+        batchIndex = np.arange(len(projection))[:, None, None]
+        linkIndex = np.arange(self.linkNumber)[None, :, None]
+        # local information
+        states = [projection[batchIndex[..., None], CUIndexes[..., :, None], CUIndexes[..., None, :]]
+                  .reshape(len(projection) * self.linkNumber, -1)]
+        # exchanged information
+        if CELL_NUMBER > 1:
+            states.append(projection[batchIndex, topIndexes, linkIndex].reshape(len(projection) * self.linkNumber, -1))
+        states = np.concatenate(states, axis=1)
+        return states / np.max(states, axis=1, keepdims=True)
+
     def train(self):
-        if self.memoryPool.getSize() > BATCH_SIZE:
-            batch = self.memoryPool.getBatch()
-            states = np.concatenate([item[0] for item in batch])
-            rewards = np.concatenate([item[1] for item in batch])
-            x = torch.from_numpy(states).float().to(self.device)
-            y = torch.from_numpy(rewards).float().to(self.device)
-            self.optimizer.zero_grad()
-            self.DQN.zero_grad()
-            y_predict = self.DQN(x)
-            loss = self.loss(y_predict, y)
-            loss.backward()
-            self.optimizer.step()
+        if self.memoryPool.getSize() > self.batchSize:
+            loss = trainStep(self.DQN, self.optimizer, self.loss, self.memoryPool, self.batchSize, self.device)
             # log and add
             self.trainSlot += 1
-            self.accumulateLoss += loss.item()
+            self.accumulateLoss += loss
             self.printInformation()
             self.decreaseEpsilon()
 
+    def startLearner(self):
+        """start learner process, actor keeps simulating and selecting actions in this process"""
+        self.logger.info("----------------Start Learner Process------------------")
+        context = torch.multiprocessing.get_context("spawn")
+        self.memoryPool.share(context)
+        self.sharedDQN = DQN(INPUT_LAYER, OUTPUT_LAYER)
+        self.sharedDQN.load_state_dict(self.DQN.state_dict())
+        self.sharedDQN.share_memory()
+        self.sharedLock = context.Lock()
+        self.readyEvent = context.Event()
+        self.stopEvent = context.Event()
+        self.learnerRecord = torch.zeros(2, dtype=torch.float64).share_memory_()
+        self.learner = context.Process(target=learnerProcess, daemon=True,
+                                       args=(self.memoryPool, self.sharedDQN, self.sharedLock, self.readyEvent, self.stopEvent,
+                                             self.learnerRecord, self.batchSize, self.device))
+        self.learner.start()
+        """spawned learner re-imports torch, wait so that its start-up is not counted as training time"""
+        while not self.readyEvent.wait(timeout=1):
+            if not self.learner.is_alive():
+                raise Exception("Learner process exited before it was ready, exit code: " + str(self.learner.exitcode))
+
+    def syncLearner(self):
+        """actor side of decoupled training: pull weights every ACTOR_SYNC_SLOT slots, follow learner epsilon"""
+        if self.learner is None:
+            self.startLearner()
+        self.actorSlot += 1
+        if self.actorSlot % ACTOR_SYNC_SLOT == 0:
+            with self.sharedLock:
+                self.DQN.load_state_dict(self.sharedDQN.state_dict())
+        # same epsilon schedule as synchronous training, one decrease per learner step
+        trainSlot, accumulateLoss = int(self.learnerRecord[0]), float(self.learnerRecord[1])
+        self.epsilon = max(EPSILON / (1 + EPSILON_DECREASE) ** trainSlot, EPSILON_MIN)
+        if self.actorSlot % PRINT_SLOT == 0:
+            averageLoss = (accumulateLoss - self.accumulateLoss) / max(trainSlot - self.trainSlot, 1)
+            self.logger.info(f'actor slot = {self.actorSlot}, train slot = {trainSlot}, average loss = {averageLoss}, '
+                             f'current epsilon = {self.epsilon}')
+            self.trainSlot, self.accumulateLoss = trainSlot, accumulateLoss
+
+    def stopLearner(self):
+        """stop learner process and load its final weights"""
+        if self.learner is None:
+            return
+        self.stopEvent.set()
+        self.learner.join()
+        self.DQN.load_state_dict(self.sharedDQN.state_dict())
+        self.trainSlot = int(self.learnerRecord[0])
+        self.learner = None
+        self.logger.info(f"----------------Stop Learner Process, Train Slot {self.trainSlot}------------------")
+        if self.trainSlot == 0:
+            self.logger.warning("Learner process never trained, the model is not updated")
+
     def saveModel(self):
         self.logger.info(f"----------------Save Model To {MODEL_PATH}------------------")
         torch.save(self.DQN.state_dict(), MODEL_PATH)
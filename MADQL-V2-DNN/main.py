@@ -3,7 +3,7 @@ import matplotlib
 
 from descision_maker import setDecisionMaker
 from utils import setLogger, cdf, Algorithm
-from mobile_network import MobileNetwork, plotMobileNetwork
+from mobile_network import MobileNetwork, BatchMobileNetwork, plotMobileNetwork
 
 matplotlib.rcParams.update({'font.size': 13})
 
@@ -16,7 +16,7 @@ if __name__ == "__main__":
         mn = MobileNetwork(loadNetwork="3-Links", totalTimeSlot=2000, printSlot=10)
 
         mn.dm = setDecisionMaker(Algorithm.RANDOM)
-        mn.step()
+        mn.evaluate()
         cdf(mn.getAverageCapacity(), label="RANDOM")
         mn.clearRecord()
 
@@ -37,15 +37,36 @@ if __name__ == "__main__":
 
         mn.dm = setDecisionMaker(Algorithm.MADQL)
         mn.step()
+    elif EXECUTION_MODE == "TRAIN_BATCH_MADQL":
+        """saved 21-Links topology plus newly generated ones, trained with one shared DQN"""
+        prefix = "Batch"
+        mn = BatchMobileNetwork(loadNetworks=["21-Links"], networkNumber=7, totalTimeSlot=1000, printSlot=50,
+                                savePrefix=prefix)
+        mn.step()
     elif EXECUTION_MODE == "TEST_MADQL":
         prefix = "test"
         mn = MobileNetwork(loadNetwork="21-Links", trainNetwork=False, totalTimeSlot=2000, printSlot=10, savePrefix=prefix)
         plotMobileNetwork(mn.getSectors(), mn.getUEs())
 
         mn.dm = setDecisionMaker(Algorithm.MADQL, loadModel=True)
-        mn.step()
+        mn.evaluate()
+    elif EXECUTION_MODE == "COMPARE_ON_TRACE":
+        """record one channel trace, every decision maker is evaluated on the same channels"""
+        MobileNetwork(loadNetwork="21-Links", totalTimeSlot=2000).recordTrace(name="21-Links")
+        for algorithm in [Algorithm.RANDOM, Algorithm.MAX_POWER, Algorithm.MADQL, Algorithm.CELL_ES]:
+            mn = MobileNetwork(loadNetwork="21-Links", trainNetwork=False, totalTimeSlot=2000, printSlot=100,
+                               savePrefix="trace", loadTrace="21-Links")
+            mn.dm = setDecisionMaker(algorithm, loadModel=True)
+            """CELL_ES only runs slot by slot"""
+            if algorithm == Algorithm.CELL_ES:
+                mn.step()
+            else:
+                mn.evaluate()
+            cdf(mn.getAverageCapacity(), label=str(algorithm))
+        plt.legend(loc='upper left')
+        plt.show()
     elif EXECUTION_MODE == "TRAIN_3_LINKS_MADQL":
-        """Remember to set CELL_NUMBER to 1"""
+        """Remember to set CELL_RING to 0"""
         mn = MobileNetwork(loadNetwork="3-Links", totalTimeSlot=100000, printSlot=100)
         mn.dm = setDecisionMaker(Algorithm.MADQL)
         mn.step()
@@ -16,3 +16,8 @@ class MaxPower:
         for _ in range(self.linkNumber):
             actions.append([POWER_LEVEL - 1, random.randint(0, CODEBOOK_SIZE - 1)])
         return actions
+
+    def takeActionTrace(self, timeSlot):
+        """takeAction of timeSlot time slots as one integer array, shape: [timeSlot, links, 2]"""
+        return np.stack([np.full((timeSlot, self.linkNumber), POWER_LEVEL - 1),
+                         np.random.randint(0, CODEBOOK_SIZE, size=(timeSlot, self.linkNumber))], axis=-1)
@@ -1,18 +1,123 @@
-import random
-from collections import deque
+import torch
 
 from config import *
 
 
+class SumTree:
+    """array sum-tree, node k has children 2k and 2k + 1, leaf i is node leafNumber + i"""
+
+    def __init__(self, capacity):
+        self.leafNumber = 1 << (capacity - 1).bit_length()
+        self.tree = np.zeros(2 * self.leafNumber, dtype=float)
+
+    def getTotal(self):
+        return self.tree[1]
+
+    def getPriority(self, index):
+        return self.tree[self.leafNumber + index]
+
+    def update(self, index, priority):
+        """set priority of leaves index, parents are updated level by level in O(log n)"""
+        node = np.asarray(index) + self.leafNumber
+        self.tree[node] = priority
+        node = np.unique(node // 2)
+        while node[0] > 0:
+            self.tree[node] = self.tree[2 * node] + self.tree[2 * node + 1]
+            node = np.unique(node // 2)
+
+    def find(self, value):
+        """leaf index of every value in [0, total), all values descend the tree together in O(log n)"""
+        node = np.ones(len(value), dtype=int)
+        value = np.array(value, dtype=float)
+        while node[0] < self.leafNumber:
+            left = 2 * node
+            right = value >= self.tree[left]
+            value = np.where(right, value - self.tree[left], value)
+            node = left + right
+        return node - self.leafNumber
+
+
 class MemoryPool:
-    def __init__(self, capacity=MP_MAX_SIZE):
-        self.pool = deque([], maxlen=capacity)
+    """ring buffer of (state, target, action index) rows in preallocated tensors, optionally prioritized replay"""
+
+    def __init__(self, capacity=MP_MAX_SIZE, inputLayer=INPUT_LAYER, outputLayer=OUTPUT_LAYER, device="cpu",
+                 prioritized=PRIORITIZED_REPLAY):
+        self.capacity = capacity
+        self.device = device
+        self.states = torch.zeros((capacity, inputLayer), dtype=torch.float32, device=device)
+        self.targets = torch.zeros((capacity, outputLayer), dtype=torch.float32, device=device)
+        self.actions = torch.zeros(capacity, dtype=torch.long, device=device)     # column of the reward in targets
+        self.pointer = torch.zeros(2, dtype=torch.long)                # [write position, size]
+        self.lock = None
+        # prioritized replay
+        self.prioritized = prioritized
+        if prioritized:
+            self.sumTree = SumTree(capacity)
+            self.maxPriority = 1.
+            self.beta = PER_BETA
+
+    def share(self, context):
+        """move buffer to shared memory, so that processes of context can push and sample concurrently"""
+        if self.prioritized:
+            raise Exception("Prioritized replay can not be shared among processes")
+        self.states.share_memory_()
+        self.targets.share_memory_()
+        self.actions.share_memory_()
+        self.pointer.share_memory_()
+        self.lock = context.Lock()
 
-    def push(self, record):
-        self.pool.extend(record)
+    def push(self, states, targets, actions):
+        """write rows of states, targets and taken action indexes in place, oldest rows are overwritten"""
+        if self.lock is not None:
+            with self.lock:
+                self._push_(states, targets, actions)
+        else:
+            self._push_(states, targets, actions)
 
     def getSize(self):
-        return len(self.pool)
+        return int(self.pointer[1])
 
     def getBatch(self, size=BATCH_SIZE):
-        return random.sample(self.pool, size)
+        """
+        Returns:
+            states, targets, action indexes, row index, importance sampling weights (None when not prioritized)
+        """
+        if self.prioritized:
+            return self._getPrioritizedBatch_(size)
+        if self.lock is not None:
+            with self.lock:
+                index = torch.randint(self.getSize(), (size,), device=self.device)
+                return self.states[index], self.targets[index], self.actions[index], index, None
+        index = torch.randint(self.getSize(), (size,), device=self.device)
+        return self.states[index], self.targets[index], self.actions[index], index, None
+
+    def updatePriority(self, index, errors):
+        """priority = (|TD error| + PER_EPSILON) ^ PER_ALPHA"""
+        priority = np.power(np.abs(torch.as_tensor(errors).cpu().numpy()) + PER_EPSILON, PER_ALPHA)
+        self.sumTree.update(torch.as_tensor(index).cpu().numpy(), priority)
+        self.maxPriority = max(self.maxPriority, float(np.max(priority)))
+
+    def _push_(self, states, targets, actions):
+        position, size = int(self.pointer[0]), int(self.pointer[1])
+        index = (position + torch.arange(len(states), device=self.device)) % self.capacity
+        self.states[index] = torch.as_tensor(states, dtype=torch.float32, device=self.device)
+        self.targets[index] = torch.as_tensor(targets, dtype=torch.float32, device=self.device)
+        self.actions[index] = torch.as_tensor(actions, dtype=torch.long, device=self.device)
+        if self.prioritized:
+            self.sumTree.update(index.cpu().numpy(), self.maxPriority)
+        self.pointer[0] = (position + len(states)) % self.capacity
+        self.pointer[1] = min(size + len(states), self.capacity)
+
+    def _getPrioritizedBatch_(self, size):
+        # stratified sampling, one value in every segment of total priority
+        segment = self.sumTree.getTotal() / size
+        values = (np.arange(size) + np.random.rand(size)) * segment
+        index = np.minimum(self.sumTree.find(values), self.getSize() - 1)
+        # importance sampling weights, normalized by max
+        probability = self.sumTree.getPriority(index) / self.sumTree.getTotal()
+        weights = np.power(self.getSize() * probability, -self.beta)
+        weights /= np.max(weights)
+        self.beta = min(1., self.beta + PER_BETA_INCREASE)
+        index = torch.from_numpy(index).to(self.device)
+        weights = torch.from_numpy(weights).float().to(self.device)
+        return self.states[index], self.targets[index], self.actions[index], index, weights
@@ -1,22 +1,32 @@
 import logging
 
 from config import *
-from utils import Algorithm, calCapacity, saveData
+from utils import Algorithm, calCapacity, calCapacityTrace, saveData
 from descision_maker import setDecisionMaker
 from mobile_network_generator import generateMobileNetwork, loadMobileNetwork, plotMobileNetwork, saveMobileNetwork
-from env import Environment
+from env import Environment, BatchEnvironment, SparseEnvironment
 
 
 class MobileNetwork:
     def __init__(self, loadNetwork="default", newNetwork=False, decisionMaker=Algorithm.RANDOM, loadModel=False,
-                 trainNetwork=True, totalTimeSlot=TOTAL_TIME_SLOT, printSlot=PRINT_SLOT, savePrefix="default"):
+                 trainNetwork=True, totalTimeSlot=TOTAL_TIME_SLOT, printSlot=PRINT_SLOT, savePrefix="default",
+                 loadTrace=None, sparse=SPARSE_ENVIRONMENT):
         self.logger = logging.getLogger()
         if loadNetwork != "default" and not newNetwork:
             """load sector/UE position from local file"""
             self.sectors, self.UEs = loadMobileNetwork(loadNetwork)
         else:
             self.sectors, self.UEs = generateMobileNetwork()
-        self.env = Environment(self.sectors, self.UEs)
+        """replay recorded channel trace if loadTrace is set, sparse channels for large networks"""
+        if sparse:
+            """sparse channels only have the primitives of MADQL, RANDOM and MAX_POWER with static UEs"""
+            if decisionMaker in [Algorithm.CELL_ES, Algorithm.BEST_RESPONSE]:
+                raise Exception("Sparse environment does not support decision maker " + str(decisionMaker))
+            if loadTrace is not None or UE_MOBILITY != "NONE":
+                raise Exception("Sparse environment does not support channel trace or UE mobility")
+            self.env = SparseEnvironment(self.sectors, self.UEs)
+        else:
+            self.env = Environment(self.sectors, self.UEs, trace=loadTrace)
         self.dm = setDecisionMaker(decisionMaker, loadModel)
         self.accumulateCapacity = 0.
         self.capacity = []                                      # number of links * time slot
@@ -55,6 +65,13 @@ class MobileNetwork:
     def setTotalTimeSlot(self, timeSlot):
         self.totalTimeSlot = timeSlot
 
+    def recordTrace(self, name="default"):
+        """record channels of totalTimeSlot time slots, replay by MobileNetwork(..., loadTrace=name)"""
+        if isinstance(self.env, SparseEnvironment):
+            raise Exception("Sparse environment does not support channel trace")
+        self.logger.info(f"-------------------Record Channel Trace {name}------------------")
+        self.env.recordTrace(self.totalTimeSlot, name)
+
     def step(self):
         self.logger.info(f"-------------------Total Time Slot: {self.totalTimeSlot}------------------")
         self.logger.info(f"----------------------Save Prefix: {self.savePrefix}---------------------")
@@ -64,7 +81,9 @@ class MobileNetwork:
             if self.dm.algorithm == Algorithm.RANDOM or self.dm.algorithm == Algorithm.MAX_POWER:
                 actions = self.dm.takeAction()
             elif self.dm.algorithm == Algorithm.CELL_ES:
-                actions = self.dm.takeAction(self.env)     # CELL_ES only work when CELL_NUMBER is 1
+                actions = self.dm.takeAction(self.env)
+            elif self.dm.algorithm == Algorithm.BEST_RESPONSE:
+                actions = self.dm.takeAction(self.env)
             elif self.dm.algorithm == Algorithm.MADQL:
                 actions = self.dm.takeAction(self.env, trainNetwork=self.trainNetwork)
             """calculate capacity"""
@@ -85,7 +104,112 @@ class MobileNetwork:
         self.saveRecord(prefix=self.savePrefix+"-"+str(self.dm.algorithm)+"-")
         """save model"""
         if self.dm.algorithm == Algorithm.MADQL and self.trainNetwork:
+            self.dm.stopLearner()
+            self.dm.saveModel()
+        """stop ES processes"""
+        if self.dm.algorithm == Algorithm.CELL_ES:
+            self.dm.close()
+
+    def evaluate(self):
+        """
+        Same records as step for decision makers whose actions never change channels (RANDOM, MAX_POWER and MADQL
+        test), the channel trace of all time slots is generated first (or replayed) and evaluated in chunks of
+        TRACE_CHUNK_SIZE
+        """
+        if self.dm.algorithm not in [Algorithm.RANDOM, Algorithm.MAX_POWER, Algorithm.MADQL] \
+                or (self.dm.algorithm == Algorithm.MADQL and self.trainNetwork):
+            raise Exception("Offline evaluation only works for RANDOM, MAX_POWER and MADQL test")
+        if isinstance(self.env, SparseEnvironment):
+            raise Exception("Offline evaluation does not support sparse environment, use step")
+        self.logger.info(f"-------------------Total Time Slot: {self.totalTimeSlot}------------------")
+        self.logger.info(f"----------------------Save Prefix: {self.savePrefix}---------------------")
+        for CSI, _, topPathLossTable in self.env.generateTrace(self.totalTimeSlot):
+            if self.dm.algorithm == Algorithm.MADQL:
+                actions = self.dm.takeActionTrace(CSI, topPathLossTable, self.env)
+            else:
+                actions = self.dm.takeActionTrace(len(CSI))
+            capacity = calCapacityTrace(actions, CSI, self.env.getInterferenceMask())
+            """record"""
+            self.actionHistory.extend(actions.tolist())
+            self.capacity.extend(capacity.tolist())
+            self.averageCapacity.extend(np.mean(capacity, axis=1).tolist())
+            self.logger.info(f'mode: {self.dm.algorithm}, time slot: {len(self.averageCapacity)}, '
+                             f'system average capacity: {np.mean(capacity)}')
+        """save reward"""
+        self.saveRecord(prefix=self.savePrefix+"-"+str(self.dm.algorithm)+"-")
+
+
+class BatchMobileNetwork:
+    """
+    Several mobile networks with the same number of links stepped at the same time slot,
+    MADQL agents of all networks share one DQN forward per time slot
+    """
+
+    def __init__(self, loadNetworks=(), networkNumber=0, decisionMaker=Algorithm.MADQL, loadModel=False,
+                 trainNetwork=True, totalTimeSlot=TOTAL_TIME_SLOT, printSlot=PRINT_SLOT, savePrefix="default"):
+        self.logger = logging.getLogger()
+        """saved topologies in loadNetworks and networkNumber newly generated ones"""
+        networks = [loadMobileNetwork(name) for name in loadNetworks] \
+            + [generateMobileNetwork() for _ in range(networkNumber)]
+        self.env = BatchEnvironment(networks)
+        self.dm = setDecisionMaker(decisionMaker, loadModel)
+        self.accumulateCapacity = 0.
+        self.capacity = []                                      # time slot * number of networks * number of links
+        self.averageCapacity = []                               # time slot * number of networks
+        self.trainNetwork = trainNetwork
+        self.totalTimeSlot = totalTimeSlot
+        self.printSlot = printSlot
+        self.savePrefix = savePrefix
+
+    def getCapacity(self):
+        return self.capacity
+
+    def getAverageCapacity(self):
+        return self.averageCapacity
+
+    def clearRecord(self):
+        self.capacity = []
+        self.averageCapacity = []
+
+    def saveRecord(self, prefix="default-"):
+        self.logger.info(f"--------------------------Save Rewards as {prefix}-----------------------------")
+        saveData(self.capacity, name=prefix+"capacity")
+        saveData(self.averageCapacity, name=prefix+"averageCapacity")
+
+    def step(self):
+        self.logger.info(f"-------------------Total Time Slot: {self.totalTimeSlot}------------------")
+        self.logger.info(f"----------------Number of Networks: {self.env.networkNumber}---------------")
+        for ts in range(self.totalTimeSlot):
+            """take action"""
+            if self.dm.algorithm == Algorithm.MADQL:
+                networkActions = self.dm.takeActionBatch(self.env, trainNetwork=self.trainNetwork)
+            elif self.dm.algorithm == Algorithm.RANDOM or self.dm.algorithm == Algorithm.MAX_POWER:
+                networkActions = [self.dm.takeAction() for _ in range(self.env.networkNumber)]
+            else:
+                networkActions = [self.dm.takeAction(env) for env in self.env.getEnvironments()]
+            """calculate capacity"""
+            currentCapacity = [calCapacity(actions, env)
+                               for actions, env in zip(networkActions, self.env.getEnvironments())]
+            """record"""
+            self.capacity.append(currentCapacity)
+            averageCapacity = [sum(capacity) / len(capacity) for capacity in currentCapacity]
+            self.averageCapacity.append(averageCapacity)
+            """update"""
+            self.env.update()
+            """print log"""
+            if ts != 0 and ts % self.printSlot == 0:
+                self.logger.info(f'mode: {self.dm.algorithm}, time slot: {ts + 1}, system average capacity: {self.accumulateCapacity / self.printSlot}')
+                self.accumulateCapacity = 0.
+            self.accumulateCapacity += sum(averageCapacity) / len(averageCapacity)
+        """save reward"""
+        self.saveRecord(prefix=self.savePrefix+"-batch-"+str(self.dm.algorithm)+"-")
+        """save model"""
+        if self.dm.algorithm == Algorithm.MADQL and self.trainNetwork:
+            self.dm.stopLearner()
             self.dm.saveModel()
+        """stop ES processes"""
+        if self.dm.algorithm == Algorithm.CELL_ES:
+            self.dm.close()
 
 
 if __name__ == "__main__":
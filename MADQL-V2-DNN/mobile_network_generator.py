@@ -46,19 +46,31 @@ def generateUE(centerIndex, sectors):
     return UEs
 
 
+def generateCellCenters(ringNumber=CELL_RING):
+    """
+    Centers of the hexagonal cells of ringNumber rings around cell 0, ring k starts from the corner at -150 degree
+    and walks its 6 sides of k cells counterclockwise
+    Returns:
+        cell centers, shape: [1 + 3 * ringNumber * (ringNumber + 1), 2]
+    """
+    centerR = CELL_SIZE * np.sqrt(3)
+    sideAngle = (-30 + 60 * np.arange(6)) / 360 * 2 * np.pi
+    sideStep = centerR * np.stack([np.cos(sideAngle), np.sin(sideAngle)], axis=1)
+    cornerAngle = -150 / 360 * 2 * np.pi
+    centers = [np.zeros(shape=[1, 2])]
+    for k in range(1, ringNumber + 1):
+        corner = k * centerR * np.array([np.cos(cornerAngle), np.sin(cornerAngle)])
+        """k steps along every side, cumulative from the corner"""
+        steps = np.repeat(sideStep, k, axis=0)
+        centers.append(corner + np.concatenate([np.zeros(shape=[1, 2]), np.cumsum(steps[:-1], axis=0)]))
+    return np.concatenate(centers)
+
+
 def generateMobileNetwork():
     sectors = []
     UEs = []
 
-    for i in range(CELL_NUMBER):
-        if i == 0:
-            centerX = 0.
-            centerY = 0.
-        else:
-            centerR = CELL_SIZE * np.sqrt(3)
-            centerAngle = (-150 + (i - 1) * 60) / 360 * 2 * np.pi
-            centerX = centerR * np.cos(centerAngle)
-            centerY = centerR * np.sin(centerAngle)
+    for i, (centerX, centerY) in enumerate(generateCellCenters()):
         # generate sector and ue position
         tmpSectors = generateSector(i, centerX, centerY)
         tmpUEs = generateUE(i, tmpSectors)
@@ -68,23 +80,30 @@ def generateMobileNetwork():
     return sectors, UEs
 
 
+def calSiteIndex(sectors):
+    """sectors at the same position share a site, hashed by position rounded to mm, shape: [links]"""
+    siteIndex = {}
+    return np.array([siteIndex.setdefault(tuple(np.round(sector.getPosition()[:2], 3)), len(siteIndex))
+                     for sector in sectors])
+
+
+def calIsolationMask(sectors):
+    """True if sector i and j are isolated (different sectors of the same site), shape: [links, links]"""
+    siteIndex = calSiteIndex(sectors)
+    return (siteIndex[:, None] == siteIndex[None, :]) & ~np.eye(len(sectors), dtype=bool)
+
+
 def plotMobileNetwork(sectors, UEs):
-    for i in range(CELL_NUMBER):
-        if i == 0:
-            centerX = 0.
-            centerY = 0.
-        else:
-            centerR = CELL_SIZE * np.sqrt(3)
-            centerAngle = (-150 + (i - 1) * 60) / 360 * 2 * np.pi
-            centerX = centerR * np.cos(centerAngle)
-            centerY = centerR * np.sin(centerAngle)
+    for i in range(len(sectors) // 3):
         tmpSectors = [sectors[i * 3], sectors[i * 3 + 1], sectors[i * 3 + 2]]
         tmpUEs = [UEs[i * 3], UEs[i * 3 + 1], UEs[i * 3 + 2]]
+        """cell center is the centroid of its 3 sectors"""
+        centerX, centerY = np.mean([sector.getPosition()[:2] for sector in tmpSectors], axis=0)
         plotCell(centerX, centerY, tmpSectors, tmpUEs)
 
     plt.xlabel("x/m")
     plt.ylabel("y/m")
-    plt.title("3-Links Mobile Network")
+    plt.title(f"{len(sectors)}-Links Mobile Network")
     plt.show()
 
 
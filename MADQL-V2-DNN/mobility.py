@@ -0,0 +1,78 @@
+from config import *
+
+
+class Mobility:
+    """
+    UE movement of every time slot, UE i stays in the 120 degree wedge of R_MIN to R_MAX around sector i,
+    the same area where generateUE places it
+    """
+
+    def __init__(self, sectorPositions, UEPositions, model=UE_MOBILITY, speed=UE_SPEED, pauseSlot=UE_PAUSE_SLOT):
+        self.model = model
+        self.sectorPositions = np.array(sectorPositions, dtype=float)
+        self.UEPositions = np.array(UEPositions, dtype=float)
+        self.UENumber = len(self.UEPositions)
+        self.speed = speed
+        self.pauseSlot = pauseSlot
+        self.wedgeStart = (np.arange(self.UENumber) % 3) * 2 * np.pi / 3
+        if model == "RANDOM_WAYPOINT":
+            self.waypoints = self._drawWaypoints_(np.arange(self.UENumber))
+            self.pause = np.zeros(self.UENumber, dtype=int)
+        elif model == "CONSTANT_VELOCITY":
+            heading = np.random.rand(self.UENumber) * 2 * np.pi
+            self.velocity = speed * np.stack([np.cos(heading), np.sin(heading)], axis=1)
+        else:
+            raise Exception("Incorrect UE mobility setting: " + model)
+
+    def getPositions(self):
+        return self.UEPositions
+
+    def step(self):
+        """move UEs by one time slot, return index of UEs that moved"""
+        if self.model == "RANDOM_WAYPOINT":
+            return self._stepRandomWaypoint_()
+        else:
+            return self._stepConstantVelocity_()
+
+    def isInside(self, index, positions):
+        """True if positions of UE index are in the area of their sectors"""
+        relative = positions[:, :2] - self.sectorPositions[index, :2]
+        r = np.linalg.norm(relative, axis=1)
+        theta = (np.arctan2(relative[:, 1], relative[:, 0]) - self.wedgeStart[index]) % (2 * np.pi)
+        return (r >= R_MIN) & (r <= R_MAX) & (theta <= 2 * np.pi / 3)
+
+    def _stepConstantVelocity_(self):
+        positions = self.UEPositions.copy()
+        positions[:, :2] += self.velocity
+        inside = self.isInside(np.arange(self.UENumber), positions)
+        """UEs hitting the border turn back and stay for this time slot"""
+        self.velocity[~inside] *= -1
+        moved = np.flatnonzero(inside)
+        self.UEPositions[moved] = positions[moved]
+        return moved
+
+    def _stepRandomWaypoint_(self):
+        waiting = self.pause > 0
+        self.pause[waiting] -= 1
+        moved = np.flatnonzero(~waiting)
+        direction = self.waypoints[moved] - self.UEPositions[moved, :2]
+        distance = np.linalg.norm(direction, axis=1, keepdims=True)
+        arrived = distance[:, 0] <= self.speed
+        self.UEPositions[moved, :2] += np.where(arrived[:, None], direction,
+                                                direction / np.maximum(distance, 1e-12) * self.speed)
+        """the area is not convex at R_MIN, a path cutting the inner radius is pushed out radially onto it"""
+        relative = self.UEPositions[moved, :2] - self.sectorPositions[moved, :2]
+        r = np.linalg.norm(relative, axis=1, keepdims=True)
+        self.UEPositions[moved, :2] = self.sectorPositions[moved, :2] + \
+            np.where(r < R_MIN, relative * (R_MIN * (1 + 1e-9) / r), relative)
+        """pause at the waypoint, then head for a new one"""
+        arrivedIndex = moved[arrived]
+        self.pause[arrivedIndex] = self.pauseSlot
+        self.waypoints[arrivedIndex] = self._drawWaypoints_(arrivedIndex)
+        return moved
+
+    def _drawWaypoints_(self, index):
+        """same distribution as generateUE, shape: [len(index), 2]"""
+        r = (R_MAX - R_MIN) * np.random.rand(len(index)) + R_MIN
+        theta = np.random.rand(len(index)) * 2 * np.pi / 3 + self.wedgeStart[index]
+        return self.sectorPositions[index, :2] + r[:, None] * np.stack([np.cos(theta), np.sin(theta)], axis=1)
@@ -12,6 +12,12 @@ def takeActionRandom(linkNumber):
     return actions
 
 
+def takeActionRandomTrace(timeSlot, linkNumber):
+    """takeActionRandom of timeSlot time slots as one integer array, shape: [timeSlot, links, 2]"""
+    return np.stack([np.random.randint(0, POWER_LEVEL, size=(timeSlot, linkNumber)),
+                     np.random.randint(0, CODEBOOK_SIZE, size=(timeSlot, linkNumber))], axis=-1)
+
+
 class Random:
     def __init__(self):
         self.logger = logging.getLogger()
@@ -20,3 +26,6 @@ class Random:
 
     def takeAction(self):
         return takeActionRandom(self.linkNumber)
+
+    def takeActionTrace(self, timeSlot):
+        return takeActionRandomTrace(timeSlot, self.linkNumber)
@@ -62,93 +62,84 @@ class Algorithm(Enum):
     MAX_POWER = 2
     MADQL = 3
     CELL_ES = 4
-
-
-# Interference skip list -> due sector isolation
-SKIP_LIST = {
-    0: [4, 8],
-    1: [11, 12],
-    2: [15, 19],
-    3: [],
-    4: [0, 8],
-    5: [18],
-    6: [],
-    7: [9],
-    8: [0, 4],
-    9: [7],
-    10: [],
-    11: [1, 12],
-    12: [1, 11],
-    13: [],
-    14: [16],
-    15: [2, 19],
-    16: [14],
-    17: [],
-    18: [5],
-    19: [2, 15],
-    20: []
-}
-
-
-def generateChannelIndex(transmitterIndex, receiverIndex):
-    return f'{transmitterIndex}-{receiverIndex}'
+    BEST_RESPONSE = 5
 
 
 def calCapacity(actions, env):
-    capacity = []
-
-    for i in range(len(actions)):
-        power = dBm2num(POWER_LIST[actions[i][0]])
-        beamformer = BEAMFORMER_LIST[actions[i][1]]
-        directChannel = env.getChannel(i, i).getCSI()
-        """signal"""
-        signalPower = power * np.power(np.linalg.norm(np.matmul(directChannel, beamformer)), 4)
-        """noise"""
-        noisePower = dBm2num(NOISE_POWER) * np.power(np.linalg.norm(np.matmul(directChannel, beamformer)), 2)
-        """interference"""
-        interferencePower = 0.
-        for j in range(len(actions)):
-            if env.isDirectLink(i, j) or env.isIsolated(i, j):
-                continue
-            else:
-                otherPower = dBm2num(POWER_LIST[actions[j][0]])
-                otherBeamformer = BEAMFORMER_LIST[actions[j][1]]
-                otherChannel = env.getChannel(j, i).getCSI()
-                interferencePower += otherPower * np.power(np.linalg.norm(np.matmul(
-                    np.matmul(np.matmul(beamformer.transpose().conjugate(), directChannel.transpose().conjugate()),
-                              otherChannel), otherBeamformer)), 2)
-        capacity.append(np.log2(1 + signalPower / (noisePower + interferencePower)))
-
-    return capacity
+    return calCapacityBatch(np.expand_dims(actions, 0), env)[0].tolist()
+
+
+def calCapacityBatch(actions, env):
+    """
+    Capacity of a batch of joint actions under current CSI of env
+    Args:
+        actions: integer array of [power index, beamformer index], shape: [N, links, 2]
+        env: Environment or SparseEnvironment
+    Returns:
+        capacity of every link, shape: [N, links]
+    """
+    actions = np.asarray(actions)
+    linkIndex = np.arange(actions.shape[1])
+    power = dBm2num(np.asarray(POWER_LIST, dtype=FLOAT_DTYPE))[actions[..., 0]]
+    beamformer = actions[..., 1]
+    directProjection = env.getDirectProjection()[linkIndex, beamformer]
+    """signal"""
+    signalPower = power * np.power(directProjection, 4)
+    """noise"""
+    noisePower = dBm2num(NOISE_POWER) * np.power(directProjection, 2)
+    """interference"""
+    interferencePower = env.calInterferencePower(power, beamformer)
+
+    return np.log2(1 + signalPower / (noisePower + interferencePower))
+
+
+def calCapacityTrace(actions, CSI, interferenceMask):
+    """
+    Capacity of every time slot of a channel trace, same as calCapacity slot by slot, only gains of the selected
+    beamformers are calculated
+    Args:
+        actions: integer array of [power index, beamformer index], shape: [T, links, 2]
+        CSI: channel trace, shape: [T, transmitter, receiver, UT_ANTENNA, BS_ANTENNA]
+        interferenceMask: True if link j interferes link i, shape: [receiver, interferer]
+    Returns:
+        capacity of every link, shape: [T, links]
+    """
+    actions = np.asarray(actions)
+    power = dBm2num(np.asarray(POWER_LIST, dtype=FLOAT_DTYPE))[actions[..., 0]]
+    beamformer = BEAMFORMER_MATRIX.T[actions[..., 1]]
+    """H_ji * f_j of transmitter j and all receivers i"""
+    beamformedCSI = np.einsum("tjiub,tjb->tjiu", CSI, beamformer)
+    linkIndex = np.arange(actions.shape[1])
+    directCSI = beamformedCSI[:, linkIndex, linkIndex]
+    directProjection = np.linalg.norm(directCSI, axis=-1)
+    """signal"""
+    signalPower = power * np.power(directProjection, 4)
+    """noise"""
+    noisePower = dBm2num(NOISE_POWER) * np.power(directProjection, 2)
+    """interference, index [receiver, interferer]"""
+    crossGain = np.einsum("tiu,tjiu->tij", directCSI.conjugate(), beamformedCSI)
+    interferenceGain = np.square(np.abs(crossGain)) * interferenceMask
+    interferencePower = np.matmul(interferenceGain, power[..., None])[..., 0]
+
+    return np.log2(1 + signalPower / (noisePower + interferencePower))
 
 
 def calLocalCapacity(actions, env, CUIndex):
-    capacity = []
-    indexes = getLinkIndexByCUIndex(CUIndex)
-
-    for i in range(3):
-        power = dBm2num(POWER_LIST[actions[i][0]])
-        beamformer = BEAMFORMER_LIST[actions[i][1]]
-        directChannel = env.getChannel(indexes[i], indexes[i]).getCSI()
-        """signal"""
-        signalPower = power * np.power(np.linalg.norm(np.matmul(directChannel, beamformer)), 4)
-        """noise"""
-        noisePower = dBm2num(NOISE_POWER) * np.power(np.linalg.norm(np.matmul(directChannel, beamformer)), 2)
-        """interference"""
-        interferencePower = 0.
-        for j in range(3):
-            if env.isDirectLink(indexes[i], indexes[j]):
-                continue
-            else:
-                otherPower = dBm2num(POWER_LIST[actions[j][0]])
-                otherBeamformer = BEAMFORMER_LIST[actions[j][1]]
-                otherChannel = env.getChannel(indexes[j], indexes[i]).getCSI()
-                interferencePower += otherPower * np.power(np.linalg.norm(np.matmul(
-                    np.matmul(np.matmul(beamformer.transpose().conjugate(), directChannel.transpose().conjugate()),
-                              otherChannel), otherBeamformer)), 2)
-        capacity.append(np.log2(1 + signalPower / (noisePower + interferencePower)))
-
-    return capacity
+    actions = np.asarray(actions)
+    indexes = np.asarray(getLinkIndexByCUIndex(CUIndex))
+    power = dBm2num(np.asarray(POWER_LIST, dtype=FLOAT_DTYPE))[actions[:, 0]]
+    beamformer = actions[:, 1]
+    directProjection = env.getProjection()[indexes, indexes, beamformer]
+    """signal"""
+    signalPower = power * np.power(directProjection, 4)
+    """noise"""
+    noisePower = dBm2num(NOISE_POWER) * np.power(directProjection, 2)
+    """interference, only from links in the same CU"""
+    interferenceGain = env.getInterferenceGain()[indexes[:, None], indexes, beamformer[:, None], beamformer]
+    interferencePower = np.sum(power * interferenceGain, axis=1)
+    capacity = np.log2(1 + signalPower / (noisePower + interferencePower))
+
+    return capacity.tolist()
 
 
 def cdf(x, plot=True, *args, **kwargs):
@@ -157,7 +148,7 @@ def cdf(x, plot=True, *args, **kwargs):
 
 
 def action2Index(action):
-    return action[0] * (POWER_LEVEL - 1) + action[1]
+    return action[0] * CODEBOOK_SIZE + action[1]
 
 
 def index2Action(index):